@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, select, update
+from auth_cache import TTLCache
+from database import AsyncSessionLocal, serialized_writes
+from grading import dump_answers, load_answers
+import models
+
+logger = logging.getLogger(__name__)
+
+# Buffered autosaves and heartbeats are written at most this many seconds apart
+ATTEMPT_FLUSH_INTERVAL = float(os.getenv("ATTEMPT_FLUSH_INTERVAL", "2"))
+# ... or as soon as this many attempts have unsaved answers
+ATTEMPT_FLUSH_PENDING = int(os.getenv("ATTEMPT_FLUSH_PENDING", "1000"))
+# Answers sent up to this long after the deadline still count (network latency)
+ATTEMPT_GRACE_SECONDS = int(os.getenv("ATTEMPT_GRACE_SECONDS", "30"))
+ATTEMPT_CACHE_SIZE = 10000
+ATTEMPT_CACHE_TTL = 600
+
+
+class AttemptClosed(Exception):
+    """The attempt was submitted or its time is up, so it takes no more answers."""
+
+
+def attempt_deadline(paper, started_at: datetime):
+    if not paper.duration_minutes:
+        return None
+    return started_at + timedelta(minutes=paper.duration_minutes)
+
+def accepts_answers(deadline, now: datetime) -> bool:
+    return deadline is None or now <= deadline + timedelta(seconds=ATTEMPT_GRACE_SECONDS)
+
+def remaining_seconds(deadline, now: datetime):
+    if deadline is None:
+        return None
+    return max(0, int((deadline - now).total_seconds()))
+
+def attempt_status(status: str, deadline, now: datetime) -> str:
+    # "expired" is never stored: the attempt can still be submitted with its saved answers
+    if status == "in_progress" and not accepts_answers(deadline, now):
+        return "expired"
+    return status
+
+
+async def start_attempt(db, paper, user_id: int, now: datetime):
+    """The user's open attempt at the paper if its time isn't up, else a new one (not committed)."""
+    attempt = await db.scalar(
+        select(models.ExamAttempt)
+        .where(models.ExamAttempt.user_id == user_id,
+               models.ExamAttempt.paper_id == paper.id,
+               models.ExamAttempt.status == "in_progress")
+        .order_by(models.ExamAttempt.id.desc())
+        .limit(1)
+    )
+    if attempt is not None and accepts_answers(attempt.deadline, now):
+        return attempt
+    attempt = models.ExamAttempt(
+        user_id=user_id,
+        paper_id=paper.id,
+        status="in_progress",
+        started_at=now,
+        deadline=attempt_deadline(paper, now),
+        answers="{}",
+        revision=0,
+        last_seen_at=now,
+    )
+    db.add(attempt)
+    return attempt
+
+
+class _AttemptState:
+    # What autosave and heartbeat need to know, so they don't read the database
+    __slots__ = ("user_id", "deadline", "submitted", "revision")
+
+    def __init__(self, attempt, revision: int):
+        self.user_id = attempt.user_id
+        self.deadline = attempt.deadline
+        self.submitted = attempt.status != "in_progress"
+        self.revision = revision
+
+
+class AutosaveBuffer:
+    """Write-behind buffer for autosaves and heartbeats of running attempts.
+
+    An autosave carries the whole answer sheet and a client revision, so
+    only the newest save per attempt is kept and written. Flushes run every
+    ATTEMPT_FLUSH_INTERVAL seconds as one transaction of batched UPDATEs.
+    The UPDATEs only move an attempt's revision forward, so processes
+    flushing saves for the same attempt in any order still agree.
+    A crash loses at most the last interval of saves.
+    """
+
+    def __init__(self, interval: float = ATTEMPT_FLUSH_INTERVAL, session_factory=AsyncSessionLocal):
+        self.interval = interval
+        self._session_factory = session_factory
+        self._states = TTLCache(ATTEMPT_CACHE_SIZE, ttl=ATTEMPT_CACHE_TTL)
+        self._saves = {}  # attempt_id -> (revision, answers as JSON)
+        self._seen = {}  # attempt_id -> time of the latest autosave or heartbeat
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._wake = None
+        self._stopping = False
+        self.saves = 0
+        self.coalesced = 0
+        self.stale = 0
+        self.heartbeats = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_errors = 0
+
+    async def state(self, db, attempt_id: int):
+        """Cached facts about an attempt, read from the database on a miss; None if it doesn't exist."""
+        state = self._states.get(attempt_id)
+        if state is None:
+            attempt = await db.get(models.ExamAttempt, attempt_id)
+            if attempt is None:
+                return None
+            pending = self._saves.get(attempt_id)
+            state = _AttemptState(attempt, max(attempt.revision, pending[0] if pending else 0))
+            self._states.set(attempt_id, state)
+        return state
+
+    def _check_open(self, state: _AttemptState, now: datetime):
+        if state.submitted:
+            raise AttemptClosed("Attempt already submitted")
+        if not accepts_answers(state.deadline, now):
+            raise AttemptClosed("Time is up")
+
+    def save(self, attempt_id: int, state: _AttemptState, revision: int, answers: dict, now: datetime) -> bool:
+        """Buffer an answer sheet; False if a newer revision is already saved."""
+        self._check_open(state, now)
+        self._seen[attempt_id] = now
+        if revision <= state.revision:
+            # Arrived out of order behind a newer save
+            self.stale += 1
+            return False
+        if attempt_id in self._saves:
+            self.coalesced += 1
+        self._saves[attempt_id] = (revision, dump_answers(answers))
+        state.revision = revision
+        self.saves += 1
+        if len(self._saves) >= ATTEMPT_FLUSH_PENDING and self._wake is not None:
+            self._wake.set()
+        return True
+
+    def heartbeat(self, attempt_id: int, state: _AttemptState, now: datetime):
+        self._check_open(state, now)
+        self._seen[attempt_id] = now
+        self.heartbeats += 1
+
+    def status(self, attempt_id: int, state: _AttemptState, now: datetime) -> dict:
+        return {
+            "id": attempt_id,
+            "status": attempt_status("submitted" if state.submitted else "in_progress", state.deadline, now),
+            "revision": state.revision,
+            "deadline": state.deadline,
+            "remaining_seconds": remaining_seconds(state.deadline, now),
+            "server_time": now,
+        }
+
+    def saved_answers(self, attempt):
+        """(revision, answers) of an attempt, including a save still in this buffer."""
+        pending = self._saves.get(attempt.id)
+        if pending is not None and pending[0] > attempt.revision:
+            return pending[0], load_answers(pending[1])
+        return attempt.revision, load_answers(attempt.answers)
+
+    def view(self, attempt, now: datetime) -> dict:
+        revision, answers = self.saved_answers(attempt)
+        return {
+            "id": attempt.id,
+            "paper_id": attempt.paper_id,
+            "user_id": attempt.user_id,
+            "status": attempt_status(attempt.status, attempt.deadline, now),
+            "started_at": attempt.started_at,
+            "deadline": attempt.deadline,
+            "remaining_seconds": remaining_seconds(attempt.deadline, now),
+            "revision": revision,
+            "answers": answers,
+            "submission_id": attempt.submission_id,
+        }
+
+    def final_answers(self, attempt, submitted, now: datetime):
+        """(answers, time_spent) to record for an attempt submitted at `now`.
+
+        Answers sent with the submission count until the grace period is
+        over; after that the last saved answers are marked. Time spent stops
+        at the deadline.
+        """
+        if submitted is not None and accepts_answers(attempt.deadline, now):
+            answers = submitted
+        else:
+            answers = self.saved_answers(attempt)[1]
+        finished = now if attempt.deadline is None else min(now, attempt.deadline)
+        return answers, max(0, int((finished - attempt.started_at).total_seconds()))
+
+    def closed(self, attempt_id: int):
+        """Drop a submitted attempt's buffered changes; call after committing the submission."""
+        self._saves.pop(attempt_id, None)
+        self._seen.pop(attempt_id, None)
+        state = self._states.get(attempt_id)
+        if state is not None:
+            state.submitted = True
+
+    async def flush(self) -> int:
+        """Write everything buffered in one transaction; returns the attempts written."""
+        async with self._flush_lock:
+            saves, self._saves = self._saves, {}
+            seen, self._seen = self._seen, {}
+            if not saves and not seen:
+                return 0
+            try:
+                async with self._session_factory() as db, serialized_writes():
+                    await self._write(db, saves, seen)
+                    await db.commit()
+            except Exception:
+                # Keep what hasn't been superseded meanwhile for the next flush
+                for attempt_id, save in saves.items():
+                    current = self._saves.get(attempt_id)
+                    if current is None or current[0] < save[0]:
+                        self._saves[attempt_id] = save
+                for attempt_id, at in seen.items():
+                    self._seen.setdefault(attempt_id, at)
+                self.flush_errors += 1
+                raise
+            self.flushes += 1
+            self.rows_written += len(seen.keys() | saves.keys())
+            return len(seen.keys() | saves.keys())
+
+    async def _write(self, db, saves: dict, seen: dict):
+        attempts = models.ExamAttempt.__table__
+        running = (attempts.c.id == bindparam("attempt_id")) & (attempts.c.status == "in_progress")
+        if saves:
+            # One executemany; a save older than the stored revision matches no row
+            await db.execute(
+                update(attempts)
+                .where(running, attempts.c.revision < bindparam("new_revision"))
+                .values(answers=bindparam("new_answers"), revision=bindparam("new_revision")),
+                [{"attempt_id": attempt_id, "new_revision": revision, "new_answers": answers}
+                 for attempt_id, (revision, answers) in saves.items()]
+            )
+        if seen:
+            await db.execute(
+                update(attempts).where(running).values(last_seen_at=bindparam("seen_at")),
+                [{"attempt_id": attempt_id, "seen_at": at} for attempt_id, at in seen.items()]
+            )
+
+    def start(self):
+        """Run the flush loop on the running event loop."""
+        if self._task is not None:
+            return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Autosave flush failed, retrying in %ss", self.interval)
+
+    async def drain(self):
+        """Stop the flush loop and write what is still buffered."""
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Final autosave flush failed, %s attempts lost their latest save", len(self._saves))
+
+    def metrics(self) -> dict:
+        return {
+            "pending": len(self._saves),
+            "saves": self.saves,
+            "coalesced": self.coalesced,
+            "stale": self.stale,
+            "heartbeats": self.heartbeats,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "flush_errors": self.flush_errors,
+        }
+
+autosave_buffer = AutosaveBuffer()
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from shared_state import invalidation_bus
+
+# Upper bounds keep memory flat no matter how many users hit the API
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# How long a user row may be served from memory before it is re-read
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries also expire at a given time."""
+
+    def __init__(self, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key):
+        """Like get(), but without counting a lookup or refreshing the LRU position."""
+        item = self._data.get(key)
+        if item is None or (item[0] is not None and item[0] <= time.time()):
+            return None
+        return item[1]
+
+    def set(self, key, value, expires_at: float = None):
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# sha256(token) -> username, kept until the token's own "exp"
+token_cache = TTLCache(TOKEN_CACHE_SIZE)
+# username -> schemas.User snapshot
+user_cache = TTLCache(USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def invalidate_user(username: str):
+    user_cache.pop(username)
+    # Other workers drop their copy on their next poll
+    invalidation_bus.publish("user", username)
+
+def sync_invalidations():
+    invalidation_bus.poll()
+
+invalidation_bus.subscribe("user", user_cache.pop)
+
+def cache_stats() -> dict:
+    return {"tokens": token_cache.stats(), "users": user_cache.stats()}
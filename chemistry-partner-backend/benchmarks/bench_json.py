@@ -0,0 +1,118 @@
+"""Compare the ORM/response_model list path with the FAST_JSON path.
+
+Builds a throwaway database with --rows submissions for one user and
+--rows questions spread over one full page of papers, then times
+GET /papers/submissions/user?limit=1000 and GET /papers/?limit=200 in-process
+through both paths and checks they return the same JSON.
+
+    python benchmarks/bench_json.py --rows 10000 --repeat 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_environment(workdir: str):
+    # Must happen before main is imported: it creates tables and upload dirs on import
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    os.chdir(workdir)
+    sys.path.insert(0, str(BACKEND_DIR))
+
+def seed(rows: int, papers: int):
+    from database import engine
+    import models
+
+    questions_per_paper = max(1, rows // papers)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(models.Paper.__table__.insert(), [
+            {"id": i, "title": f"Paper {i}", "description": "Benchmark paper " * 4,
+             "duration_minutes": 60, "total_marks": 100, "pdf_path": None}
+            for i in range(1, papers + 1)
+        ])
+        conn.execute(models.Question.__table__.insert(), [
+            {"paper_id": i // questions_per_paper % papers + 1, "question_text": f"What is compound {i}?",
+             "answer": f"Answer {i}", "marks": 2}
+            for i in range(rows)
+        ])
+        conn.execute(models.PaperSubmission.__table__.insert(), [
+            {"paper_id": i % papers + 1, "user_id": 1, "time_spent": 600 + i % 900,
+             "marks": i % 100, "submitted_at": start + timedelta(minutes=i)}
+            for i in range(rows)
+        ])
+
+async def time_route(client, url: str, headers: dict, repeat: int, before=None):
+    timings = []
+    body = None
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        response = await client.get(url, headers=headers)
+        timings.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+        body = response.content
+    return statistics.median(timings), body
+
+async def run(rows: int, repeat: int):
+    import httpx
+    import main
+    from database import async_engine, SessionLocal
+    import models
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/register", json={"email": "bench@example.com", "username": "bench", "password": "bench"})
+        with SessionLocal() as db:
+            user = db.query(models.User).filter_by(username="bench").one()
+            assert user.id == 1, "benchmark expects a fresh database"
+        token = (await client.post("/token", data={"username": "bench", "password": "bench"})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        routes = [
+            ("GET /papers/submissions/user?limit=1000", f"/papers/submissions/user?limit={main.SUBMISSIONS_MAX_PAGE_SIZE}", None),
+            # Drop the response cache each time so the serialisation path is what gets measured
+            ("GET /papers/?limit=200", f"/papers/?limit={main.PAPERS_MAX_PAGE_SIZE}", main.paper_cache.invalidate),
+        ]
+        results = []
+        for name, url, before in routes:
+            main.FAST_JSON = False
+            orm_ms, orm_body = await time_route(client, url, headers, repeat, before)
+            main.FAST_JSON = True
+            fast_ms, fast_body = await time_route(client, url, headers, repeat, before)
+            results.append({
+                "route": name,
+                "orm_ms": round(orm_ms, 2),
+                "fast_json_ms": round(fast_ms, 2),
+                "speedup": round(orm_ms / fast_ms, 2),
+                "same_output": json.loads(orm_body) == json.loads(fast_body),
+            })
+    await async_engine.dispose()
+    main.hashing_pool.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        setup_environment(workdir)
+        import main
+        if not main.startup_gate.ready:
+            main.startup_gate.run_sync()  # STARTUP_MODE=fast defers the schema
+        seed(args.rows, main.PAPERS_MAX_PAGE_SIZE)
+        for result in asyncio.run(run(args.rows, args.repeat)):
+            print(json.dumps(result))
@@ -0,0 +1,384 @@
+"""In-process load and latency benchmark for the API.
+
+Seeds a throwaway database with realistic volumes (users, papers with
+questions, stored PDFs, submission history), then drives main.app through
+httpx's ASGI transport with concurrent virtual users, one scenario at a time:
+
+    login_storm       POST /token with real bcrypt verification
+    catalogue         paginated GET /papers/, GET /papers/{id}, cached revalidations
+    pdf_downloads     full downloads, If-None-Match revalidations and byte ranges
+    submission_burst  POST /papers/{id}/submit, batches, history and stats reads
+    mixed             a weighted blend of the above
+
+Each virtual user has its own client address, so per-IP rate limits behave
+as they would with real clients, and like them it retries a 503 after its
+Retry-After. Reported per scenario and route: request count, ok / rejected
+(429, or 503 after MAX_RETRIES) / error counts with the failing statuses,
+retries, p50/p95/p99 latency (retries included) and throughput. A batch
+that rejects any of its items counts as an error.
+
+    python benchmarks/bench_load.py --save benchmarks/baselines/load.json
+    python benchmarks/bench_load.py --baseline benchmarks/baselines/load.json --threshold 0.3
+
+With --baseline the exit status is 1 when a route's p50 or p95 grows by more
+than --threshold (relative) plus --slack-ms, its error or rejection rate by
+more than --threshold plus --slack-rate, or a scenario's throughput drops
+by more than --threshold. --save refuses to write a baseline with errors.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SCENARIOS = ("login_storm", "catalogue", "pdf_downloads", "submission_burst", "mixed")
+PASSWORD = "benchmark-password"
+REJECTED = (429, 503)
+MAX_RETRIES = 20  # 503s retried per request; the login storm queues on the hashing pool
+
+# check: optional response -> bool for replies that are 2xx but still failed
+Call = namedtuple("Call", "route method url user kwargs check", defaults=(None,))
+
+
+def setup_environment(workdir: str):
+    # Must happen before main is imported: settings are read on import
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ.setdefault("BCRYPT_ROUNDS", "10")
+    os.chdir(workdir)
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def question_id(args, paper: int, number: int) -> int:
+    # Seeded ids are fixed so the workload can answer without reading the papers
+    return (paper - 1) * args.questions + number + 1
+
+def answer_key(number: int) -> str:
+    return f"Answer {number}"
+
+
+def seed(args, rng: random.Random) -> dict:
+    """Bulk-insert the data set and write the PDFs into the blob store."""
+    from database import engine
+    from hashing import _hash_password
+    from progress import backfill_progress_stats
+    from storage import blob_path
+    import hashlib
+    import models
+
+    pdfs = []
+    for i in range(args.pdfs):
+        body = b"%PDF-1.4\n" + rng.randbytes(rng.randint(100, 2000) * 1024)
+        sha256 = hashlib.sha256(body).hexdigest()
+        path = blob_path(sha256)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+        pdfs.append({"path": path.as_posix(), "etag": f'"{sha256}"', "size": len(body)})
+
+    hashed = _hash_password(PASSWORD)  # Same hash for every user keeps seeding fast
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [
+            {"id": i, "email": f"user{i}@example.com", "username": f"user{i}",
+             "hashed_password": hashed, "is_active": True, "is_admin": i == 1}
+            for i in range(1, args.users + 1)
+        ])
+        conn.execute(models.Paper.__table__.insert(), [
+            {"id": i, "title": f"Chemistry paper {i}", "description": "Organic, inorganic and physical chemistry. " * 3,
+             "duration_minutes": 90, "total_marks": 100,
+             "pdf_path": pdfs[i % len(pdfs)]["path"] if pdfs else None}
+            for i in range(1, args.papers + 1)
+        ])
+        conn.execute(models.Question.__table__.insert(), [
+            {"id": question_id(args, p, q), "paper_id": p,
+             "question_text": f"Question {q} of paper {p}: balance the equation.",
+             "answer": answer_key(q), "marks": 4}
+            for p in range(1, args.papers + 1) for q in range(args.questions)
+        ])
+        conn.execute(models.PaperSubmission.__table__.insert(), [
+            {"paper_id": rng.randint(1, args.papers), "user_id": rng.randint(1, args.users),
+             "time_spent": rng.randint(300, 5400), "marks": rng.randint(0, 100),
+             "submitted_at": start + timedelta(seconds=i * 37)}
+            for i in range(args.submissions)
+        ])
+    backfill_progress_stats(engine)
+    return {"pdfs": pdfs}
+
+
+def batch_accepted(response) -> bool:
+    return response.json()["rejected"] == 0
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Workload:
+    """Builds the request list for each scenario."""
+
+    def __init__(self, args, tokens: list, pdfs: list, rng: random.Random):
+        self.args = args
+        self.tokens = tokens
+        self.pdfs = pdfs
+        self.rng = rng
+
+    def _user(self) -> int:
+        return self.rng.randrange(len(self.tokens))
+
+    def _auth(self, user: int) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[user]}"}
+
+    def _paper(self) -> int:
+        # A few popular papers get most of the traffic
+        return min(self.args.papers, int(self.rng.paretovariate(1.2)))
+
+    def _answers(self, paper: int) -> dict:
+        # Papers with questions are marked on the server; about 70% right
+        return {question_id(self.args, paper, q): answer_key(q) if self.rng.random() < 0.7 else "no idea"
+                for q in range(self.args.questions)}
+
+    def login(self) -> Call:
+        user = self._user()
+        return Call("POST /token", "POST", "/token", user,
+                    {"data": {"username": f"user{user + 1}", "password": PASSWORD}})
+
+    def catalogue(self) -> Call:
+        user = self._user()
+        headers = self._auth(user)
+        roll = self.rng.random()
+        if roll < 0.4:
+            after = self.rng.choice([None, *range(0, self.args.papers, 50)])
+            url = "/papers/?limit=50" + (f"&after_id={after}" if after else "")
+            return Call("GET /papers/", "GET", url, user, {"headers": headers})
+        if roll < 0.5:
+            return Call("GET /papers/?include_questions=false", "GET",
+                        "/papers/?limit=200&include_questions=false", user, {"headers": headers})
+        return Call("GET /papers/{id}", "GET", f"/papers/{self._paper()}", user, {"headers": headers})
+
+    def pdf(self) -> Call:
+        user = self._user()
+        paper = self._paper()
+        url = f"/papers/{paper}/pdf?token={self.tokens[user]}"
+        roll = self.rng.random()
+        if roll < 0.2 or not self.pdfs:
+            return Call("GET /papers/{id}/pdf", "GET", url, user, {})
+        pdf = self.pdfs[paper % len(self.pdfs)]
+        if roll < 0.7:
+            return Call("GET /papers/{id}/pdf (revalidate)", "GET", url, user,
+                        {"headers": {"If-None-Match": pdf["etag"]}})
+        offset = self.rng.randrange(0, max(1, pdf["size"] - 65536))
+        return Call("GET /papers/{id}/pdf (range)", "GET", url, user,
+                    {"headers": {"Range": f"bytes={offset}-{offset + 65535}"}})
+
+    def submission(self) -> Call:
+        user = self._user()
+        headers = self._auth(user)
+        roll = self.rng.random()
+        if roll < 0.6:
+            paper = self._paper()
+            return Call("POST /papers/{id}/submit", "POST", f"/papers/{paper}/submit", user,
+                        {"headers": headers, "json": {"time_spent": self.rng.randint(300, 5400),
+                                                      "answers": self._answers(paper)}})
+        if roll < 0.7:
+            items = []
+            for _ in range(self.args.batch_size):
+                paper = self._paper()
+                items.append({"paper_id": paper, "time_spent": 600, "answers": self._answers(paper)})
+            return Call("POST /papers/submissions/batch", "POST", "/papers/submissions/batch", user,
+                        {"headers": headers, "json": {"submissions": items}}, batch_accepted)
+        if roll < 0.85:
+            return Call("GET /papers/submissions/user", "GET", "/papers/submissions/user", user,
+                        {"headers": headers})
+        return Call("GET /papers/submissions/stats", "GET", "/papers/submissions/stats", user,
+                    {"headers": headers})
+
+    def build(self, scenario: str, count: int) -> list:
+        if scenario == "mixed":
+            makers = [self.catalogue] * 6 + [self.pdf] * 2 + [self.submission] * 2
+            return [self.rng.choice(makers)() for _ in range(count)] + [self.login() for _ in range(count // 50)]
+        maker = {"login_storm": self.login, "catalogue": self.catalogue,
+                 "pdf_downloads": self.pdf, "submission_burst": self.submission}[scenario]
+        return [maker() for _ in range(count)]
+
+
+async def run_scenario(clients: list, calls: list, concurrency: int) -> dict:
+    samples = defaultdict(list)
+    outcomes = defaultdict(lambda: {"ok": 0, "rejected": 0, "errors": 0, "retries": 0})
+    failures = defaultdict(lambda: defaultdict(int))  # route -> status -> count
+    queue = iter(calls)
+
+    async def worker():
+        for call in queue:
+            started = time.perf_counter()
+            for attempt in range(MAX_RETRIES + 1):
+                response = await clients[call.user].request(call.method, call.url, **call.kwargs)
+                retry_after = response.headers.get("retry-after")
+                if response.status_code != 503 or retry_after is None or attempt == MAX_RETRIES:
+                    break
+                outcomes[call.route]["retries"] += 1
+                await asyncio.sleep(float(retry_after))
+            samples[call.route].append((time.perf_counter() - started) * 1000)
+            if response.status_code < 400 and (call.check is None or call.check(response)):
+                outcomes[call.route]["ok"] += 1
+                continue
+            if response.status_code in REJECTED:
+                outcomes[call.route]["rejected"] += 1
+            else:
+                outcomes[call.route]["errors"] += 1
+            failures[call.route][str(response.status_code)] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    routes = {}
+    for route, values in sorted(samples.items()):
+        values.sort()
+        routes[route] = {
+            "count": len(values),
+            **outcomes[route],
+            "failures": dict(sorted(failures[route].items())),
+            "p50_ms": round(percentile(values, 50), 2),
+            "p95_ms": round(percentile(values, 95), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+            "rps": round(len(values) / wall, 1),
+        }
+    return {"requests": len(calls), "wall_s": round(wall, 3),
+            "throughput_rps": round(len(calls) / wall, 1), "routes": routes}
+
+
+async def run(args) -> dict:
+    import httpx
+    import main
+    from database import async_engine
+
+    rng = random.Random(args.seed)
+    if not main.startup_gate.ready:
+        main.startup_gate.run_sync()
+    data = seed(args, rng)
+    tokens = [main.create_access_token(data={"sub": f"user{i}"}) for i in range(1, args.users + 1)]
+    workload = Workload(args, tokens, data["pdfs"], rng)
+
+    clients = [
+        httpx.AsyncClient(
+            # Unhandled server exceptions come back as 500s and count as errors, like behind uvicorn
+            transport=httpx.ASGITransport(app=main.app, raise_app_exceptions=False,
+                                          client=(f"10.{i // 65536}.{i // 256 % 256}.{i % 256}", 40000)),
+            base_url="http://bench",
+        )
+        for i in range(args.users)
+    ]
+    results = {}
+    try:
+        for scenario in args.scenario or SCENARIOS:
+            count = args.logins if scenario == "login_storm" else args.requests
+            results[scenario] = await run_scenario(clients, workload.build(scenario, count), args.concurrency)
+            print(f"{scenario}: {results[scenario]['throughput_rps']} req/s", file=sys.stderr)
+    finally:
+        for client in clients:
+            await client.aclose()
+        await async_engine.dispose()
+        main.hashing_pool.shutdown()
+    return results
+
+
+def error_count(results: dict) -> int:
+    return sum(route["errors"] for scenario in results["scenarios"].values()
+               for route in scenario["routes"].values())
+
+def regressions(results: dict, baseline: dict, threshold: float, slack_ms: float, slack_rate: float) -> list:
+    found = []
+    for scenario, before in baseline.get("scenarios", {}).items():
+        after = results["scenarios"].get(scenario)
+        if after is None:
+            continue
+        if after["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            found.append(f"{scenario}: throughput {before['throughput_rps']} -> {after['throughput_rps']} req/s")
+        for route, old in before["routes"].items():
+            new = after["routes"].get(route)
+            if new is None:
+                continue
+            for metric in ("p50_ms", "p95_ms"):
+                if new[metric] > old[metric] * (1 + threshold) + slack_ms:
+                    found.append(f"{scenario} {route}: {metric} {old[metric]} -> {new[metric]}")
+            for outcome in ("errors", "rejected"):
+                old_rate = old.get(outcome, 0) / old["count"]
+                new_rate = new[outcome] / new["count"]
+                if new_rate > old_rate * (1 + threshold) + slack_rate:
+                    found.append(f"{scenario} {route}: {outcome} {old_rate:.1%} -> {new_rate:.1%} "
+                                 f"{new['failures']}")
+    return found
+
+def print_table(results: dict):
+    for scenario, result in results["scenarios"].items():
+        print(f"\n{scenario}: {result['requests']} requests in {result['wall_s']}s "
+              f"({result['throughput_rps']} req/s)")
+        print(f"  {'route':<40} {'count':>6} {'ok':>6} {'rej':>5} {'err':>5} {'retry':>6} "
+              f"{'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8}  failures")
+        for route, r in result["routes"].items():
+            print(f"  {route:<40} {r['count']:>6} {r['ok']:>6} {r['rejected']:>5} {r['errors']:>5} {r['retries']:>6} "
+                  f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['rps']:>8}  {r['failures'] or ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append", help="default: all scenarios")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--papers", type=int, default=300)
+    parser.add_argument("--questions", type=int, default=25, help="questions per paper")
+    parser.add_argument("--pdfs", type=int, default=20, help="distinct PDF blobs")
+    parser.add_argument("--submissions", type=int, default=50000, help="seeded submission history")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--logins", type=int, default=200, help="requests in the login storm")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", type=Path, help="write the results as a new baseline")
+    parser.add_argument("--baseline", type=Path, help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--slack-ms", type=float, default=10.0,
+                        help="absolute latency allowance on top of --threshold")
+    parser.add_argument("--slack-rate", type=float, default=0.01,
+                        help="absolute error/rejection rate allowance on top of --threshold")
+    parser.add_argument("--allow-errors", action="store_true", help="save a baseline even if requests failed")
+    parser.add_argument("--json", action="store_true", help="print the raw JSON instead of a table")
+    args = parser.parse_args()
+    # Resolve before setup_environment changes into the scratch directory
+    args.save = args.save and args.save.resolve()
+    args.baseline = args.baseline and args.baseline.resolve()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        setup_environment(workdir)
+        results = {
+            "config": {key: value for key, value in vars(args).items()
+                       if key not in ("save", "baseline", "json", "scenario", "allow_errors")},
+            "scenarios": asyncio.run(run(args)),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+    if args.save:
+        if error_count(results) and not args.allow_errors:
+            # A baseline with failures would excuse the same failures later
+            sys.exit(f"Not saving {args.save}: {error_count(results)} requests failed (see failures)")
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps(results, indent=2) + "\n")
+    if args.baseline:
+        found = regressions(results, json.loads(args.baseline.read_text()), args.threshold, args.slack_ms,
+                            args.slack_rate)
+        for line in found:
+            print("REGRESSION", line)
+        sys.exit(1 if found else 0)
@@ -0,0 +1,140 @@
+"""Measure cold-start cost: import time and time to first response.
+
+Every run starts a fresh interpreter against a fresh SQLite file, as on a
+Render free-plan instance waking up, and reports medians per STARTUP_MODE.
+The server is started the way render.yaml does it, python serve.py with
+--workers WEB_CONCURRENCY:
+
+    import_s     python -c "import main"
+    live_s       process spawn -> first 200 from GET /health/live
+    first_api_s  process spawn -> first response from an API route
+    ready_s      process spawn -> first 200 from GET /health/ready
+
+    python benchmarks/bench_startup.py --runs 5 --save benchmarks/baselines/startup.json
+    python benchmarks/bench_startup.py --runs 5 --baseline benchmarks/baselines/startup.json
+
+With --baseline the exit status is 1 when any median is slower than the
+baseline by more than --tolerance (relative) plus --slack seconds.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+MODES = ("eager", "fast")
+POLL_INTERVAL = 0.005
+TIMEOUT = 60
+
+
+def _env(workdir: str, mode: str, workers: int = 1) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "STARTUP_MODE": mode,
+        "WEB_CONCURRENCY": str(workers),
+        "DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+        "PYTHONPATH": str(BACKEND_DIR),
+        "PYTHONWARNINGS": "ignore",
+    })
+    return env
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _get_status(port: int, path: str):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=TIMEOUT)
+    try:
+        conn.request("GET", path)
+        return conn.getresponse().status
+    except OSError:
+        return None
+    finally:
+        conn.close()
+
+def measure_import(mode: str) -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    with tempfile.TemporaryDirectory() as workdir:
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=workdir, env=_env(workdir, mode),
+            check=True, capture_output=True, text=True,
+        ).stdout
+    return float(out.strip().splitlines()[-1])
+
+def measure_first_response(mode: str, workers: int) -> dict:
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        env = {**_env(workdir, mode, workers), "HOST": "127.0.0.1", "PORT": str(port)}
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, str(BACKEND_DIR / "serve.py")],
+            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            timings = {}
+            # The API route answers 401 without a token, after the readiness gate
+            probes = {"live_s": "/health/live", "first_api_s": "/papers/", "ready_s": "/health/ready"}
+            while probes and time.perf_counter() - started < TIMEOUT:
+                for name, path in list(probes.items()):
+                    status = _get_status(port, path)
+                    if status is not None and (status != 503 or name != "ready_s"):
+                        timings[name] = time.perf_counter() - started
+                        del probes[name]
+                time.sleep(POLL_INTERVAL)
+            if probes:
+                raise RuntimeError(f"server did not answer {sorted(probes)} within {TIMEOUT}s")
+            return timings
+        finally:
+            server.terminate()
+            server.wait()
+
+def run(runs: int, modes=MODES, workers: int = 2) -> dict:
+    results = {}
+    for mode in modes:
+        samples = {"import_s": [], "live_s": [], "first_api_s": [], "ready_s": []}
+        for _ in range(runs):
+            samples["import_s"].append(measure_import(mode))
+            for name, value in measure_first_response(mode, workers).items():
+                samples[name].append(value)
+        results[mode] = {name: round(statistics.median(values), 4) for name, values in samples.items()}
+    return results
+
+def regressions(results: dict, baseline: dict, tolerance: float, slack: float) -> list:
+    found = []
+    for mode, metrics in baseline.items():
+        for name, before in metrics.items():
+            after = results.get(mode, {}).get(name)
+            if after is not None and after > before * (1 + tolerance) + slack:
+                found.append(f"{mode}.{name}: {before:.3f}s -> {after:.3f}s")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mode", choices=MODES, action="append", help="default: all modes")
+    parser.add_argument("--workers", type=int, default=2, help="WEB_CONCURRENCY, as in render.yaml")
+    parser.add_argument("--save", type=Path, help="write the results as a new baseline")
+    parser.add_argument("--baseline", type=Path, help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--slack", type=float, default=0.05)
+    args = parser.parse_args()
+
+    results = run(args.runs, args.mode or MODES, args.workers)
+    print(json.dumps(results, indent=2))
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps(results, indent=2) + "\n")
+    if args.baseline:
+        found = regressions(results, json.loads(args.baseline.read_text()), args.tolerance, args.slack)
+        for line in found:
+            print("REGRESSION", line)
+        sys.exit(1 if found else 0)
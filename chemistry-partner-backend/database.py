@@ -1,23 +1,248 @@
-from sqlalchemy import create_engine
+import argparse
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from sqlalchemy import create_engine, event, inspect, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./chemistry_partner.db"
+# Point DATABASE_URL at a server database (e.g. postgresql://...) to move off SQLite
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chemistry_partner.db")
+
+# Async drivers used when ASYNC_DATABASE_URL is not given explicitly
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def _async_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend!r}, set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(SQLALCHEMY_DATABASE_URL)
+DB_DIALECT = make_url(SQLALCHEMY_DATABASE_URL).get_backend_name()
+IS_SQLITE = DB_DIALECT == "sqlite"
+
+# "async" (default) serves requests from the aiosqlite engine below,
+# "sync" keeps the original blocking Session so the two can be benchmarked
+DB_MODE = os.getenv("DB_MODE", "async").lower()
+if DB_MODE not in ("async", "sync"):
+    raise ValueError(f"DB_MODE must be 'async' or 'sync', got {DB_MODE!r}")
+
+# Connection pool settings for the async engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# SQLite storage profile: "production" applies WAL and the tuned pragmas
+# below to every connection, "default" keeps SQLite's stock settings
+DB_STORAGE_PROFILE = os.getenv("DB_STORAGE_PROFILE", "production").lower()
+if DB_STORAGE_PROFILE not in ("production", "default"):
+    raise ValueError(f"DB_STORAGE_PROFILE must be 'production' or 'default', got {DB_STORAGE_PROFILE!r}")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+PRODUCTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",  # Safe with WAL; only the last commits may roll back on power loss
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",  # Negative means KiB rather than pages
+    f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in PRODUCTION_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False} if IS_SQLITE else {}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+)
+# expire_on_commit=False so objects stay readable after commit without
+# triggering implicit (blocking) refreshes
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+if IS_SQLITE and DB_STORAGE_PROFILE == "production":
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+
 Base = declarative_base()
 
+# SQLite admits one writer at a time and leaves the others polling the file
+# lock, which under load can starve one past busy_timeout ("database is
+# locked"). Every write transaction in this process queues here instead, in
+# arrival order; other processes (the CLIs, other workers) are still kept
+# out by busy_timeout. Take it after any slow reads or file work, since it
+# stalls every other writer while held.
+_sqlite_writes = asyncio.Lock()
+
+@asynccontextmanager
+async def serialized_writes():
+    """Hold around a transaction's writes up to and including its commit."""
+    if not IS_SQLITE:
+        yield
+        return
+    async with _sqlite_writes:
+        yield
+
+async def hold_writes(db):
+    """Take the write lock until db's current transaction commits or rolls back.
+
+    For writes committed by other code than the one making them, such as job
+    handlers; a no-op when db already holds it.
+    """
+    session = db.sync_session
+    if not IS_SQLITE or session.info.get("holds_writes"):
+        return
+    await _sqlite_writes.acquire()
+    session.info["holds_writes"] = True
+    if not session.in_transaction():
+        session.begin()
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_writes(session, transaction):
+    if transaction.parent is None and session.info.pop("holds_writes", False):
+        _sqlite_writes.release()
+
 # Add this line after importing all your models
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+def upgrade_schema(bind):
+    """Add indexes declared in models to tables that already existed.
+
+    create_all only creates indexes together with a new table, so databases
+    created by older versions would otherwise never get them.
+    """
+    with bind.begin() as conn:
+        existing = set(inspect(conn).get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+
+class SyncSessionAdapter:
+    """Expose the awaitable AsyncSession API on top of a blocking Session.
+
+    Used in DB_MODE=sync so the endpoints run unchanged while every call
+    still executes on the event loop, exactly like the original code path.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, *args, **kwargs):
+        return self.sync_session.execute(statement, *args, **kwargs)
+
+    async def scalar(self, statement, *args, **kwargs):
+        return self.sync_session.scalar(statement, *args, **kwargs)
+
+    async def scalars(self, statement, *args, **kwargs):
+        return self.sync_session.scalars(statement, *args, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return self.sync_session.get(entity, ident, **kwargs)
+
+    async def flush(self, objects=None):
+        self.sync_session.flush(objects)
+
+    async def commit(self):
+        self.sync_session.commit()
+
+    async def rollback(self):
+        self.sync_session.rollback()
+
+    async def refresh(self, instance, attribute_names=None):
+        self.sync_session.refresh(instance, attribute_names)
+
+    async def delete(self, instance):
+        self.sync_session.delete(instance)
+
+    async def close(self):
+        self.sync_session.close()
+
+
+async def get_db():
+    if DB_MODE == "sync":
+        db = SessionLocal()
+        try:
+            yield SyncSessionAdapter(db)
+        finally:
+            db.close()
+    else:
+        async with AsyncSessionLocal() as db:
+            yield db
+
+
+def copy_database(source_engine, target_url: str, batch_size: int = 5000) -> dict:
+    """Copy every table from source_engine into the (empty) database at target_url."""
+    target_engine = create_engine(target_url)
+    Base.metadata.create_all(bind=target_engine)
+    copied = {}
+    with source_engine.connect() as source, target_engine.begin() as target:
+        for table in Base.metadata.sorted_tables:
+            result = source.execution_options(stream_results=True).execute(select(table))
+            copied[table.name] = 0
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                target.execute(table.insert(), [row._asdict() for row in rows])
+                copied[table.name] += len(rows)
+    target_engine.dispose()
+    return copied
+
+
+if __name__ == "__main__":
+    # Go through the importable module so the models register on the same Base
+    import database
+    import models  # noqa: F401
+
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("upgrade", help="create missing tables and indexes, switch to WAL, ANALYZE")
+    copy_parser = commands.add_parser("copy-to", help="copy all data into another database URL")
+    copy_parser.add_argument("target_url")
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        database.create_tables()
+        with database.engine.begin() as conn:
+            if database.IS_SQLITE:
+                print("journal_mode:", conn.exec_driver_sql("PRAGMA journal_mode").scalar())
+            conn.exec_driver_sql("ANALYZE")
+        print("schema up to date")
+    else:
+        print(database.copy_database(database.engine, args.target_url))
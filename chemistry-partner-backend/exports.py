@@ -0,0 +1,115 @@
+import csv
+import io
+import os
+import zlib
+from datetime import datetime
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select
+from database import AsyncSessionLocal
+from fast_json import dumps
+from history import as_utc_naive
+import models
+
+# Rows fetched from the server-side cursor, encoded and sent per chunk;
+# memory use is bounded by this however many rows the export has
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+EXPORT_MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def submissions_export_query(since=None, until=None, paper_id=None):
+    """Every submission with its user's name and email and the paper title, in id order."""
+    submissions = models.PaperSubmission
+    query = (
+        select(
+            submissions.id,
+            submissions.submitted_at,
+            submissions.user_id,
+            models.User.username,
+            models.User.email,
+            submissions.paper_id,
+            models.Paper.title.label("paper_title"),
+            submissions.marks,
+            submissions.time_spent,
+        )
+        .outerjoin(models.User, models.User.id == submissions.user_id)
+        .outerjoin(models.Paper, models.Paper.id == submissions.paper_id)
+        .order_by(submissions.id)
+    )
+    if paper_id is not None:
+        query = query.where(submissions.paper_id == paper_id)
+    if since is not None:
+        query = query.where(submissions.submitted_at >= as_utc_naive(since))
+    if until is not None:
+        query = query.where(submissions.submitted_at < as_utc_naive(until))
+    return query
+
+def papers_export_query():
+    """Every paper with its question and submission counts, in id order."""
+    papers = models.Paper
+    question_count = (
+        select(func.count()).where(models.Question.paper_id == papers.id).scalar_subquery()
+    )
+    submission_count = (
+        select(func.count()).where(models.PaperSubmission.paper_id == papers.id).scalar_subquery()
+    )
+    return select(
+        papers.id,
+        papers.title,
+        papers.description,
+        papers.duration_minutes,
+        papers.total_marks,
+        papers.pdf_path,
+        question_count.label("question_count"),
+        submission_count.label("submission_count"),
+    ).order_by(papers.id)
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _encode_csv(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+def _encode_ndjson(keys, rows) -> bytes:
+    return b"".join(dumps(dict(zip(keys, row))) + b"\n" for row in rows)
+
+
+async def stream_export(query, fmt: str, compress: bool = False, session_factory=AsyncSessionLocal):
+    """Yield the query's rows as CSV or NDJSON bytes, optionally as one gzip stream.
+
+    Rows come from a server-side cursor EXPORT_CHUNK_ROWS at a time. The
+    session is opened here rather than taken from get_db, because FastAPI
+    closes dependencies before a streaming body is sent.
+    """
+    keys = list(query.selected_columns.keys())
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip container
+
+    def encoded(data: bytes) -> bytes:
+        if compressor is None:
+            return data
+        # Sync-flush every chunk so the client receives it now, not when the buffer fills
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    if fmt == "csv":
+        # The header goes out before the query has even run
+        yield encoded(_encode_csv([keys]))
+    async with session_factory() as db:
+        result = await db.stream(query.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+        async for rows in result.partitions():
+            yield encoded(_encode_csv(rows) if fmt == "csv" else _encode_ndjson(keys, rows))
+    if compressor is not None:
+        yield compressor.flush()
+
+def export_response(query, fmt: str, compress: bool, name: str) -> StreamingResponse:
+    filename = f"{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}" + (".gz" if compress else "")
+    return StreamingResponse(
+        stream_export(query, fmt, compress),
+        media_type="application/gzip" if compress else EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
@@ -0,0 +1,68 @@
+import os
+import orjson
+from fastapi import Response
+from sqlalchemy import select
+from history import submission_page
+import models
+import schemas
+
+# Opt-in: list endpoints skip the ORM and response_model validation and
+# serialise plain rows straight to bytes with orjson
+FAST_JSON = os.getenv("FAST_JSON", "0") == "1"
+
+def _columns(model, schema) -> tuple:
+    # The schema's fields in declaration order (nested lists are loaded separately)
+    return tuple(getattr(model, name) for name in schema.model_fields if name != "questions")
+
+# Columns in the schemas' field order, so rows dump to the same bytes as the
+# validated schema (response_model). get_papers's ORM path dumps objects
+# without validating, so its keys follow attribute order instead.
+PAPER_COLUMNS = _columns(models.Paper, schemas.PaperSummary)
+QUESTION_COLUMNS = _columns(models.Question, schemas.Question)
+STUDENT_QUESTION_COLUMNS = _columns(models.Question, schemas.StudentQuestion)
+SUBMISSION_COLUMNS = _columns(models.PaperSubmission, schemas.PaperSubmission)
+
+
+class RawJSONResponse(Response):
+    """Sends already-serialised JSON bytes as they are."""
+
+    media_type = "application/json"
+
+
+def dumps(content) -> bytes:
+    # OPT_UTC_Z writes UTC as "Z", matching pydantic's datetime output
+    return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+def _dicts(result, columns) -> list:
+    keys = [column.key for column in columns]
+    return [dict(zip(keys, row)) for row in result]
+
+
+async def fetch_paper_rows(db, limit: int, after_id=None, include_questions: bool = True,
+                           include_answers: bool = False) -> list:
+    """One page of papers as plain dicts, plus limit+1 lookahead like get_papers.
+
+    Questions leave out their answers unless include_answers is set (admins).
+    """
+    query = select(*PAPER_COLUMNS).order_by(models.Paper.id).limit(limit + 1)
+    if after_id is not None:
+        query = query.where(models.Paper.id > after_id)
+    papers = _dicts(await db.execute(query), PAPER_COLUMNS)
+    if include_questions and papers:
+        by_paper = {}
+        for paper in papers[:limit]:
+            paper["questions"] = by_paper[paper["id"]] = []
+        columns = QUESTION_COLUMNS if include_answers else STUDENT_QUESTION_COLUMNS
+        questions = await db.execute(
+            select(*columns)
+            .where(models.Question.paper_id.in_(list(by_paper)))
+            .order_by(models.Question.id)
+        )
+        for question in _dicts(questions, columns):
+            by_paper[question["paper_id"]].append(question)
+    return papers
+
+async def fetch_submission_rows(db, user_id: int, limit: int, **filters) -> list:
+    """One page of a user's submissions as plain dicts, like get_user_submissions."""
+    result = await db.execute(submission_page(select(*SUBMISSION_COLUMNS), user_id, limit, **filters))
+    return _dicts(result, SUBMISSION_COLUMNS)
@@ -0,0 +1,313 @@
+import hashlib
+import json
+import math
+import os
+import re
+import unicodedata
+from sqlalchemy import select, update
+from starlette.concurrency import run_in_threadpool
+from auth_cache import TTLCache
+from database import serialized_writes
+from shared_state import invalidation_bus
+import models
+
+# Numeric answers within this fraction of the key are accepted (1% covers
+# rounding to 3 significant figures); "value ± tol" in the key overrides it
+GRADING_REL_TOLERANCE = float(os.getenv("GRADING_REL_TOLERANCE", "0.01"))
+GRADING_ABS_TOLERANCE = 1e-9  # Only matters when the key is 0
+ANSWER_KEY_CACHE_SIZE = int(os.getenv("ANSWER_KEY_CACHE_SIZE", "1000"))
+# Upper bound on how long a key edited outside the API can be served
+ANSWER_KEY_CACHE_TTL = int(os.getenv("ANSWER_KEY_CACHE_TTL", "600"))
+REGRADE_BATCH_SIZE = 5000
+
+ALTERNATIVE_SEPARATOR = "|"
+_SUPERSCRIPTS = str.maketrans("⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻", "0123456789+-")
+_SUPERSCRIPT_RUN = re.compile("([⁺⁻]?[⁰¹²³⁴⁵⁶⁷⁸⁹]+)")
+_WHITESPACE = re.compile(r"\s+")
+# 6.02e23, 6.02 x 10^23, 6.02*10**23, 8.314 J/(mol K)
+_NUMBER = re.compile(
+    r"^([+-]?(?:\d+(?:\.\d*)?|\.\d+))"
+    r"(?:[eE]([+-]?\d+)|\s*[x×*]\s*10\s*(?:\^|\*\*)\s*([+-]?\d+))?"
+    r"\s*(.*)$"
+)
+# What may follow a number for it to count as a quantity: unit symbols, SI
+# prefixes on the ones that take them, joined by spaces, / · * and brackets.
+# Anything else ("2-methylpropane", "1s2 2s2 2p6") is text, not a number.
+_PREFIXES = ("", "k", "m", "µ", "μ", "n", "p", "c", "d", "h", "g")
+_PREFIXED_UNITS = ("g", "mol", "l", "m", "s", "j", "cal", "pa", "v", "a", "w", "hz", "n", "ev", "ohm", "ω", "c", "k")
+_UNITS = frozenset(prefix + unit for prefix in _PREFIXES for unit in _PREFIXED_UNITS) | {
+    "min", "h", "hr", "hrs", "day", "days", "yr", "year", "years", "atm", "bar", "mmhg", "torr",
+    "ppm", "ppb", "%", "amu", "u", "da", "°", "°c", "°f", "m",
+}
+# Bare exponents only on lengths (cm3, dm3, m2) or negative (s-1, mol-1):
+# "s2" is an orbital far more often than seconds squared
+_UNIT_TOKEN = re.compile(r"^([^\W\d_]+|%|°[cf]?)(?:\^[+-]?\d+|-\d+|(?<=m)\d)?$")
+_UNIT_SEPARATORS = re.compile(r"[\s/·*()]+")
+_TOLERANCE = re.compile(r"^(.*?)\s*(?:±|\+/-)\s*(\d+(?:\.\d*)?|\.\d+)\s*(.*)$")
+# Formulas such as NaCl, CO2, Ca(OH)2, Mg2+ or CuSO4·5H2O compare case-sensitively;
+# they need a digit or two element symbols, so "No" stays a word
+_FORMULA = re.compile(r"^(?=.*(?:\d|[A-Z].*[A-Z]))(?:[A-Z][a-z]?|\d+|[()\[\]·^+-])+$")
+
+
+def normalise(value: str) -> str:
+    """Canonical spelling: NFKC (H₂O -> H2O), 10²³ -> 10^23, single spaces, no final full stop."""
+    value = _SUPERSCRIPT_RUN.sub(lambda m: "^" + m.group(1).translate(_SUPERSCRIPTS), value)
+    value = unicodedata.normalize("NFKC", value).replace("−", "-")
+    return _WHITESPACE.sub(" ", value).strip().rstrip(".").strip()
+
+def _is_unit(value: str) -> bool:
+    tokens = [token for token in _UNIT_SEPARATORS.split(value.casefold()) if token]
+    if not tokens:
+        return False
+    for token in tokens:
+        match = _UNIT_TOKEN.match(token)
+        if match is None or match.group(1) not in _UNITS:
+            return False
+    return True
+
+def parse_number(value: str):
+    """(value, unit) for a normalised numeric answer, or None if it isn't one."""
+    match = _NUMBER.match(value)
+    if match is None:
+        return None
+    mantissa, exponent, power, unit = match.groups()
+    if unit and not _is_unit(unit):
+        return None
+    # Parsed as one literal: 1e999 becomes inf instead of raising OverflowError
+    number = float(f"{mantissa}e{exponent or power or 0}")
+    if not math.isfinite(number):
+        return None
+    return number, unit.replace(" ", "").replace("^", "").casefold()
+
+def _formula_form(value: str) -> str:
+    return value.replace(" ", "").replace("^", "")  # Mg²⁺ and Mg2+ are the same ion
+
+def _is_formula(value: str) -> bool:
+    compact = value.replace(" ", "")
+    return len(compact) > 1 and _FORMULA.match(compact) is not None
+
+
+class _Numeric:
+    __slots__ = ("value", "tolerance", "unit")
+
+    def __init__(self, value: float, tolerance: float, unit: str):
+        self.value = value
+        self.tolerance = tolerance
+        self.unit = unit
+
+    def __call__(self, parsed) -> bool:
+        if parsed is None:
+            return False
+        number, unit = parsed
+        # A unit is optional in the answer, but a different one (or one the key lacks) is wrong
+        if unit and unit != self.unit:
+            return False
+        return abs(number - self.value) <= self.tolerance
+
+def _compile_alternative(key: str):
+    tolerance_match = _TOLERANCE.match(key)
+    explicit = None
+    if tolerance_match:
+        value, tolerance, unit = tolerance_match.groups()
+        key = f"{value} {unit}".strip()
+        explicit = float(tolerance)
+    parsed = parse_number(key)
+    if parsed is not None:
+        number, unit = parsed
+        tolerance = explicit if explicit is not None else max(
+            abs(number) * GRADING_REL_TOLERANCE, GRADING_ABS_TOLERANCE)
+        return _Numeric(number, tolerance, unit)
+    return key
+
+
+class AnswerKey:
+    """A paper's questions compiled once into matchers.
+
+    Each Question.answer may list alternatives separated by "|". Numeric
+    alternatives match within a tolerance and accept scientific notation;
+    text compares after normalise(), ignoring case unless the key looks
+    like a formula. `version` hashes the key, so grades can be traced to it.
+    """
+
+    def __init__(self, paper_id: int, questions):
+        self.paper_id = paper_id
+        self.question_ids = []
+        self.marks = []
+        self._formulas = []
+        self._words = []
+        self._numerics = []
+        digest = hashlib.blake2b(digest_size=8)
+        for question_id, answer, marks in questions:
+            digest.update(f"{question_id}\x1f{answer}\x1f{marks}\x1e".encode())
+            formulas = set()
+            words = set()
+            numerics = []
+            for alternative in (answer or "").split(ALTERNATIVE_SEPARATOR):
+                alternative = normalise(alternative)
+                if not alternative:
+                    continue
+                compiled = _compile_alternative(alternative)
+                if isinstance(compiled, _Numeric):
+                    numerics.append(compiled)
+                elif _is_formula(compiled):
+                    formulas.add(_formula_form(compiled))
+                else:
+                    words.add(compiled.casefold())
+            self.question_ids.append(question_id)
+            self.marks.append(marks or 0)
+            self._formulas.append(frozenset(formulas))
+            self._words.append(frozenset(words))
+            self._numerics.append(tuple(numerics))
+        self.version = digest.hexdigest()
+        self.total_marks = sum(self.marks)
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    def _check(self, index: int, answer: str) -> bool:
+        answer = normalise(answer)
+        if not answer:
+            return False
+        if answer.casefold() in self._words[index] or _formula_form(answer) in self._formulas[index]:
+            return True
+        numerics = self._numerics[index]
+        if numerics:
+            parsed = parse_number(answer)
+            return any(matcher(parsed) for matcher in numerics)
+        return False
+
+    def grade_many(self, submissions: list) -> list:
+        """Marks for each {question_id: answer} mapping, one question at a time.
+
+        Going column by column lets every distinct answer to a question be
+        normalised and checked once for the whole batch; a class mostly
+        repeats the same few answers.
+        """
+        totals = [0] * len(submissions)
+        for index, (question_id, marks) in enumerate(zip(self.question_ids, self.marks)):
+            verdicts = {}
+            for row, answers in enumerate(submissions):
+                answer = answers.get(question_id)
+                if answer is None:
+                    continue
+                correct = verdicts.get(answer)
+                if correct is None:
+                    correct = verdicts[answer] = self._check(index, answer)
+                if correct:
+                    totals[row] += marks
+        return totals
+
+    def grade(self, answers: dict) -> int:
+        return self.grade_many([answers])[0]
+
+
+class AnswerKeyCache:
+    """Compiled keys per paper; question writers call invalidate(paper_id).
+
+    Like ResponseCache, a key is only stored if no invalidation happened
+    while it was being loaded, so a slow load can't cache an old key.
+    """
+
+    def __init__(self, maxsize: int = ANSWER_KEY_CACHE_SIZE, ttl: int = ANSWER_KEY_CACHE_TTL):
+        self._keys = TTLCache(maxsize, ttl=ttl)
+        self._generation = 0
+        invalidation_bus.subscribe("answer_key", self._drop)
+
+    def _drop(self, paper_id):
+        self._generation += 1
+        self._keys.pop(int(paper_id))
+
+    def invalidate(self, paper_id: int):
+        self._drop(paper_id)
+        invalidation_bus.publish("answer_key", str(paper_id))
+
+    async def get_many(self, db, paper_ids) -> dict:
+        """paper_id -> AnswerKey (empty for papers without questions), one query for all misses."""
+        invalidation_bus.poll()
+        keys = {}
+        missing = []
+        for paper_id in paper_ids:
+            key = self._keys.get(paper_id)
+            if key is None:
+                missing.append(paper_id)
+            else:
+                keys[paper_id] = key
+        if missing:
+            generation = self._generation
+            loaded = await load_answer_keys(db, missing)
+            for paper_id, key in loaded.items():
+                if generation == self._generation:
+                    self._keys.set(paper_id, key)
+                keys[paper_id] = key
+        return keys
+
+    async def get(self, db, paper_id: int) -> AnswerKey:
+        return (await self.get_many(db, [paper_id]))[paper_id]
+
+    def stats(self) -> dict:
+        return self._keys.stats()
+
+answer_keys = AnswerKeyCache()
+
+
+async def load_answer_keys(db, paper_ids) -> dict:
+    rows = await db.execute(
+        select(models.Question.paper_id, models.Question.id, models.Question.answer, models.Question.marks)
+        .where(models.Question.paper_id.in_(paper_ids))
+        .order_by(models.Question.paper_id, models.Question.id)
+    )
+    questions = {paper_id: [] for paper_id in paper_ids}
+    for paper_id, question_id, answer, marks in rows:
+        questions[paper_id].append((question_id, answer, marks))
+    return {paper_id: AnswerKey(paper_id, items) for paper_id, items in questions.items()}
+
+
+def dump_answers(answers: dict) -> str:
+    return json.dumps({str(question_id): answer for question_id, answer in answers.items()})
+
+def load_answers(stored: str) -> dict:
+    return {int(question_id): answer for question_id, answer in json.loads(stored).items()}
+
+
+async def regrade_paper(db, paper_id: int, key: AnswerKey) -> dict:
+    """Re-mark every stored attempt at a paper against `key`, committing per batch.
+
+    Batches are graded in a worker thread and only submissions whose marks
+    change are written back.
+    """
+    graded = 0
+    changed = 0
+    after_id = 0
+    while True:
+        rows = (await db.execute(
+            select(models.SubmissionAnswers.submission_id, models.SubmissionAnswers.answers,
+                   models.PaperSubmission.marks)
+            .join(models.PaperSubmission, models.PaperSubmission.id == models.SubmissionAnswers.submission_id)
+            .where(models.SubmissionAnswers.paper_id == paper_id,
+                   models.SubmissionAnswers.submission_id > after_id)
+            .order_by(models.SubmissionAnswers.submission_id)
+            .limit(REGRADE_BATCH_SIZE)
+        )).all()
+        if not rows:
+            break
+        marks = await run_in_threadpool(key.grade_many, [load_answers(answers) for _, answers, _ in rows])
+        updates = [
+            {"id": submission_id, "marks": new}
+            for (submission_id, _, old), new in zip(rows, marks)
+            if new != old
+        ]
+        async with serialized_writes():
+            if updates:
+                # Bulk UPDATE by primary key: one executemany for the whole batch
+                await db.execute(update(models.PaperSubmission), updates)
+            await db.execute(
+                update(models.SubmissionAnswers)
+                .where(models.SubmissionAnswers.paper_id == paper_id,
+                       models.SubmissionAnswers.submission_id.between(rows[0][0], rows[-1][0]))
+                .values(key_version=key.version)
+            )
+            await db.commit()
+        after_id = rows[-1][0]
+        graded += len(rows)
+        changed += len(updates)
+    return {"paper_id": paper_id, "key_version": key.version, "graded": graded, "changed": changed}
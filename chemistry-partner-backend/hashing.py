@@ -0,0 +1,136 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from instrumentation import record_phase
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Worker processes running bcrypt, defaults to the cores divided between the web workers
+_web_workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(max(1, (os.cpu_count() or 1) // _web_workers))))
+# Jobs allowed to wait for a free worker before requests are turned away
+HASH_POOL_MAX_QUEUE = int(os.getenv("HASH_POOL_MAX_QUEUE", str(HASH_POOL_WORKERS * 4)))
+# Retry-After (seconds) sent with 503 responses when the pool is saturated
+HASH_POOL_RETRY_AFTER = int(os.getenv("HASH_POOL_RETRY_AFTER", "1"))
+
+@lru_cache(maxsize=None)
+def pwd_context():
+    # Hashes whose rounds differ from BCRYPT_ROUNDS are reported as needing
+    # an update by verify_and_update, which drives rehash-on-login.
+    # Built on first use so passlib stays out of the web process's startup.
+    from passlib.context import CryptContext
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=BCRYPT_ROUNDS
+    )
+
+
+class HashingPoolBusy(Exception):
+    """Raised when the hashing pool already has its maximum of pending jobs."""
+
+    def __init__(self, retry_after: int = HASH_POOL_RETRY_AFTER):
+        super().__init__("Password hashing pool is saturated")
+        self.retry_after = retry_after
+
+
+# These run inside the worker processes, so they must stay top-level and
+# only touch module globals that are rebuilt on import
+def _hash_password(password: str) -> str:
+    return pwd_context().hash(password)
+
+def _verify_and_update(plain_password: str, hashed_password: str):
+    return pwd_context().verify_and_update(plain_password, hashed_password)
+
+
+class HashingPool:
+    """Bounded process pool that keeps bcrypt off the event loop."""
+
+    def __init__(self, workers: int = HASH_POOL_WORKERS, max_queue: int = HASH_POOL_MAX_QUEUE):
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, max_queue)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.total_seconds = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created on first use so importing the app never forks
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self.rejected += 1
+                raise HashingPoolBusy()
+            self.in_flight += 1
+            self.submitted += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_executor(), fn, *args)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            record_phase("hash", elapsed)
+            with self._lock:
+                self.in_flight -= 1
+                self.total_seconds += elapsed
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def metrics(self) -> dict:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "peak_in_flight": self.peak_in_flight,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "avg_seconds": self.total_seconds / finished if finished else 0.0,
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+hashing_pool = HashingPool()
+
+
+async def get_password_hash(password: str) -> str:
+    return await hashing_pool.run(_hash_password, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Return (is_valid, new_hash); new_hash is set when the stored hash is outdated."""
+    valid, new_hash = await hashing_pool.run(_verify_and_update, plain_password, hashed_password)
+    if valid and new_hash:
+        with hashing_pool._lock:
+            hashing_pool.rehashed += 1
+    return valid, new_hash
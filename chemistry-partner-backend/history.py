@@ -0,0 +1,114 @@
+import base64
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import func, select, tuple_
+import models
+
+# Submission history pages; the next page's cursor is sent in SUBMISSIONS_CURSOR_HEADER
+SUBMISSIONS_PAGE_SIZE = 100
+SUBMISSIONS_MAX_PAGE_SIZE = 1000
+SUBMISSIONS_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(submitted_at: datetime, submission_id: int) -> str:
+    """Opaque cursor for the keyset (submitted_at, id) of the last row on a page."""
+    raw = f"{submitted_at.isoformat()}|{submission_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """(submitted_at, id) from encode_cursor(); ValueError if it was tampered with."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        submitted_at, submission_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(submitted_at), int(submission_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def as_utc_naive(value: datetime):
+    # Stored timestamps are naive UTC, so filters must be too
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _filtered(query, user_id: int, since=None, until=None, paper_id=None):
+    submissions = models.PaperSubmission
+    query = query.where(submissions.user_id == user_id)
+    if paper_id is not None:
+        query = query.where(submissions.paper_id == paper_id)
+    if since is not None:
+        query = query.where(submissions.submitted_at >= as_utc_naive(since))
+    if until is not None:
+        query = query.where(submissions.submitted_at < as_utc_naive(until))
+    return query
+
+def submission_page(query, user_id: int, limit: int, cursor: str = None, since=None, until=None,
+                    paper_id=None, descending: bool = False):
+    """Restrict a select over paper_submissions to one keyset page (limit+1 rows for lookahead).
+
+    Served from the (user_id, submitted_at) / (user_id, paper_id, submitted_at)
+    indexes, whose entries end with the row id, so a page costs the same at
+    the start and the end of a long history.
+    """
+    submissions = models.PaperSubmission
+    key = tuple_(submissions.submitted_at, submissions.id)
+    query = _filtered(query, user_id, since, until, paper_id)
+    if cursor is not None:
+        position = tuple_(*decode_cursor(cursor))
+        query = query.where(key < position if descending else key > position)
+    if descending:
+        query = query.order_by(submissions.submitted_at.desc(), submissions.id.desc())
+    else:
+        query = query.order_by(submissions.submitted_at, submissions.id)
+    return query.limit(limit + 1)
+
+
+def _as_date(value) -> date:
+    # SQLite's date() returns text, server databases return a date
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+async def submission_buckets(db, user_id: int, bucket: str = "day", since=None, until=None,
+                             paper_id=None) -> list:
+    """Attempts per UTC day or week (starting Monday) for chart views, oldest first.
+
+    The database groups by day; weeks are folded from those few rows here,
+    which keeps the SQL portable across dialects.
+    """
+    submissions = models.PaperSubmission
+    day = func.date(submissions.submitted_at)
+    query = _filtered(
+        select(
+            day,
+            func.count(),
+            func.count(submissions.marks),
+            func.coalesce(func.sum(submissions.marks), 0),
+            func.max(submissions.marks),
+            func.coalesce(func.sum(submissions.time_spent), 0),
+        ),
+        user_id, since, until, paper_id,
+    ).group_by(day).order_by(day)
+
+    buckets = {}
+    for day_value, attempts, marked, marks_sum, best, time_spent in await db.execute(query):
+        start = _as_date(day_value)
+        if bucket == "week":
+            start -= timedelta(days=start.weekday())
+        row = buckets.get(start)
+        if row is None:
+            row = buckets[start] = {"start": start, "attempts": 0, "marked": 0, "marks_sum": 0,
+                                    "best_marks": None, "total_time_spent": 0}
+        row["attempts"] += attempts
+        row["marked"] += marked
+        row["marks_sum"] += marks_sum
+        row["total_time_spent"] += time_spent
+        if best is not None and (row["best_marks"] is None or best > row["best_marks"]):
+            row["best_marks"] = best
+    return [
+        {
+            "start": row["start"],
+            "attempts": row["attempts"],
+            "average_marks": row["marks_sum"] / row["marked"] if row["marked"] else 0.0,
+            "best_marks": row["best_marks"],
+            "total_time_spent": row["total_time_spent"],
+        }
+        for row in buckets.values()
+    ]
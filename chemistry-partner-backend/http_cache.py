@@ -0,0 +1,122 @@
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+import anyio
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+from starlette.responses import MalformedRangeHeader, RangeNotSatisfiable
+
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    # If-None-Match uses the weak comparison function (RFC 9110 13.1.2)
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    current = _opaque_tag(etag)
+    return any(_opaque_tag(tag) == current for tag in if_none_match.split(","))
+
+def not_modified_since(if_modified_since: Optional[str], mtime: float) -> bool:
+    if not if_modified_since:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    # HTTP dates have one-second resolution
+    return int(mtime) <= since
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+def is_not_modified(request: Request, etag: Optional[str], mtime: Optional[float] = None) -> bool:
+    """Evaluate If-None-Match, falling back to If-Modified-Since when it is absent."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if mtime is None:
+        return False
+    return not_modified_since(request.headers.get("if-modified-since"), mtime)
+
+def is_partial_range(request: Request, etag: Optional[str], mtime: float, size: int) -> bool:
+    """True when the reply will be a 206 for less than the whole file."""
+    http_range = request.headers.get("range")
+    if http_range is None:
+        return False
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range not in (etag, http_date(mtime)):
+        return False  # Stale If-Range: the whole file is sent
+    try:
+        ranges = RangeFileResponse._parse_range_header(http_range, size)
+    except (MalformedRangeHeader, RangeNotSatisfiable):
+        return False
+    # Overlaps are counted twice, which only errs towards "whole file"
+    return sum(end - start for start, end in ranges) < size
+
+def not_modified_response(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def accel_redirect_response(uri: str, media_type: str, headers: dict) -> Response:
+    """Empty reply telling a fronting nginx to send the file at internal location `uri` itself."""
+    return Response(media_type=media_type, headers={**headers, "X-Accel-Redirect": uri})
+
+
+class RangeFileResponse(FileResponse):
+    """FileResponse whose multi-range replies carry the multipart/byteranges Content-Type.
+
+    Starlette 0.46 puts that value in Content-Range instead, which clients reject.
+    Whole-file and single-range bodies are handed to the server when it offers
+    the ASGI pathsend or zerocopysend extension, so no bytes pass through
+    Python; otherwise they are read in large chunks to keep threadpool hops few.
+    """
+
+    chunk_size = 1024 * 1024
+
+    async def __call__(self, scope, receive, send):
+        self._extensions = scope.get("extensions") or {}
+        await super().__call__(scope, receive, send)
+
+    async def _zero_copy(self, send, offset: int, count: int):
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            await send({"type": "http.response.zerocopysend", "file": file, "offset": offset, "count": count})
+        finally:
+            file.close()
+
+    async def _handle_simple(self, send, send_header_only):
+        if not send_header_only and "http.response.pathsend" in self._extensions:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+        elif not send_header_only and "http.response.zerocopysend" in self._extensions:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await self._zero_copy(send, 0, int(self.headers["content-length"]))
+        else:
+            await super()._handle_simple(send, send_header_only)
+
+    async def _handle_single_range(self, send, start, end, file_size, send_header_only):
+        if send_header_only or "http.response.zerocopysend" not in self._extensions:
+            return await super()._handle_single_range(send, start, end, file_size, send_header_only)
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+        await self._zero_copy(send, start, end - start)
+
+    async def _handle_multiple_ranges(self, send, ranges, file_size, send_header_only):
+        async def send_with_fixed_headers(message):
+            if message["type"] == "http.response.start":
+                headers = []
+                for name, value in message["headers"]:
+                    if name == b"content-type":
+                        continue
+                    if name == b"content-range" and value.startswith(b"multipart/byteranges"):
+                        name = b"content-type"
+                    headers.append((name, value))
+                message["headers"] = headers
+            await send(message)
+
+        await super()._handle_multiple_ranges(send_with_fixed_headers, ranges, file_size, send_header_only)
@@ -0,0 +1,218 @@
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Add a Server-Timing header (db, hash, serialize, file, total) to every response
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+# The same SQL statement run this many times in one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+PHASES = ("db", "hash", "serialize", "file")
+
+
+class RequestStats:
+    """Where one request spent its time; reached through a context variable."""
+
+    __slots__ = ("queries", "statements", "phases")
+
+    def __init__(self):
+        self.queries = 0
+        self.statements = Counter()
+        self.phases = defaultdict(float)
+
+    def server_timing(self, total: float) -> str:
+        parts = [f'db;dur={self.phases["db"] * 1000:.2f};desc="{self.queries} queries"']
+        parts += [f"{phase};dur={self.phases[phase] * 1000:.2f}" for phase in PHASES[1:] if phase in self.phases]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+_current = ContextVar("request_stats", default=None)
+
+
+def record_phase(phase: str, seconds: float):
+    stats = _current.get()
+    if stats is not None:
+        stats.phases[phase] += seconds
+
+class timed:
+    """Context manager adding the time spent inside it to the current request's phase."""
+
+    def __init__(self, phase: str):
+        self.phase = phase
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        record_phase(self.phase, time.perf_counter() - self._started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        if not executemany:
+            # A batch insert repeated per chunk is deliberate, not an N+1
+            stats.statements[statement] += 1
+        stats.phases["db"] += elapsed
+
+def instrument_engine(engine):
+    """Count and time every statement run through a (sync) engine."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counters:
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = defaultdict(float)
+
+    def inc(self, labels: tuple, amount: float = 1):
+        self.values[labels] += amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [count per bucket..., +Inf count, sum]
+        self.series = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ("le",)
+        for labels, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {series[-2]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+
+class Metrics:
+    """Per-process request metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.requests = Counters("http_requests_total", "Requests handled", ("method", "route", "status"))
+        self.latency = Histogram("http_request_duration_seconds", "Time to the end of the response",
+                                 ("method", "route"), LATENCY_BUCKETS)
+        self.queries = Histogram("db_queries_per_request", "SQL statements run per request",
+                                 ("route",), QUERY_COUNT_BUCKETS)
+        self.phases = Counters("request_phase_seconds_total", "Time spent per phase (db, hash, serialize, file)",
+                               ("route", "phase"))
+        self.n_plus_one = Counters("db_n_plus_one_requests_total",
+                                   f"Requests running one statement {N_PLUS_ONE_THRESHOLD}+ times", ("route",))
+        self._collectors = []
+
+    def add_collector(self, prefix: str, collect):
+        """Export the numeric values of collect() -> dict as gauges named prefix_key."""
+        self._collectors.append((prefix, collect))
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        self.requests.inc((method, route, str(status)))
+        self.latency.observe((method, route), seconds)
+        self.queries.observe((route,), stats.queries)
+        for phase, spent in stats.phases.items():
+            self.phases.inc((route, phase), spent)
+        if stats.statements:
+            statement, runs = stats.statements.most_common(1)[0]
+            if runs >= N_PLUS_ONE_THRESHOLD:
+                self.n_plus_one.inc((route,))
+                logger.warning("Possible N+1 on %s %s: ran %d times: %s", method, route, runs, statement[:200])
+
+    def _gauges(self) -> list:
+        lines = []
+        for prefix, collect in self._collectors:
+            for key, value in collect().items():
+                if isinstance(value, dict):
+                    for sub_key, sub_value in value.items():
+                        if isinstance(sub_value, (int, float)):
+                            lines.append(f"{prefix}_{sub_key}{_labels(('name',), (key,))} {float(sub_value)}")
+                elif isinstance(value, (int, float)):
+                    lines.append(f"{prefix}_{key} {float(value)}")
+        return lines
+
+    def render(self) -> str:
+        lines = []
+        for family in (self.requests, self.latency, self.queries, self.phases, self.n_plus_one):
+            lines += family.render()
+        lines += self._gauges()
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+
+class InstrumentationMiddleware:
+    """Times every HTTP request, collects its SQL/phase stats and feeds `metrics`."""
+
+    def __init__(self, app, registry: Metrics = metrics, server_timing: bool = SERVER_TIMING):
+        self.app = app
+        self.registry = registry
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    header = stats.server_timing(time.perf_counter() - started)
+                    message["headers"] = [*message.get("headers", []), (b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            # Label by route template so ids in the path don't explode cardinality
+            route = scope.get("route")
+            self.registry.observe(scope["method"], getattr(route, "path", "unmatched"), status_code,
+                                  time.perf_counter() - started, stats)
@@ -0,0 +1,379 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from sqlalchemy import delete, func, select, update
+from starlette.concurrency import run_in_threadpool
+from database import AsyncSessionLocal, hold_writes, serialized_writes
+from response_cache import paper_cache
+from search import index_paper, known_pdf_text, reader_text
+from storage import BLOB_GRACE_SECONDS, blob_digest, count_references, hash_file, release_blob, resolve_pdf_path
+import models
+
+logger = logging.getLogger(__name__)
+
+# Worker tasks per web process; 0 leaves the queue to `python jobs.py work`
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Idle workers look for new jobs this often (enqueues in the same process wake them at once)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# First retry waits this many seconds, doubling with every further attempt
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "10"))
+# A job running longer than this is assumed lost with its process and requeued
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+# On shutdown running jobs get this long to finish before they are requeued
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", "30"))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_SWEEP_INTERVAL = 60
+JOB_STATUS_LIMIT = 20
+
+
+class PermanentJobError(Exception):
+    """Fails the job straight away; running it again cannot help."""
+
+class RetryLater(Exception):
+    """Puts the job back in the queue for `delay` seconds."""
+
+    def __init__(self, message: str, delay: float):
+        super().__init__(message)
+        self.delay = delay
+
+
+def enqueue(db, kind: str, paper_id: int = None, pdf_path: str = None):
+    """Queue a job inside the caller's transaction; workers see it once that commits."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    now = datetime.utcnow()
+    job = models.PaperJob(kind=kind, paper_id=paper_id, pdf_path=pdf_path, status="queued",
+                          attempts=0, run_after=now, created_at=now)
+    db.add(job)
+    return job
+
+async def paper_jobs(db, paper_id: int, limit: int = JOB_STATUS_LIMIT) -> list:
+    return (await db.scalars(
+        select(models.PaperJob)
+        .where(models.PaperJob.paper_id == paper_id)
+        .order_by(models.PaperJob.id.desc())
+        .limit(limit)
+    )).all()
+
+
+def _info_value(value):
+    return str(value)[:500] if value else None
+
+def inspect_pdf(path: Path, with_text: bool = True) -> dict:
+    """Checksum, page count, document info and optionally text, parsing the file once."""
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+
+    info = {"sha256": hash_file(path), "size": path.stat().st_size, "page_count": None,
+            "title": None, "author": None, "producer": None, "text": ""}
+    try:
+        reader = PdfReader(path)
+        info["page_count"] = len(reader.pages)
+        if reader.metadata:
+            info["title"] = _info_value(reader.metadata.title)
+            info["author"] = _info_value(reader.metadata.author)
+            info["producer"] = _info_value(reader.metadata.producer)
+        if with_text:
+            info["text"] = reader_text(reader)
+    except (PyPdfError, ValueError):
+        pass  # Unparseable but intact; metadata stays empty
+    return info
+
+
+# Handlers run in their own session and return True when the catalogue
+# changed; the queue commits their writes together with the job's status.
+# They call hold_writes() before their first write, after any file work.
+
+async def process_pdf(db, job) -> bool:
+    """Verify a stored PDF, record its metadata and index its text for the paper."""
+    paper = await db.get(models.Paper, job.paper_id)
+    current = paper is not None and paper.pdf_path == job.pdf_path
+    if not current and await count_references(db, job.pdf_path) == 0:
+        return False  # Replaced or deleted before the job got to it
+    metadata = await db.get(models.PdfMetadata, job.pdf_path)
+    pdf_text = await known_pdf_text(db, job.pdf_path)
+    text_needed = current and pdf_text is None
+    if metadata is None or text_needed:
+        path = resolve_pdf_path(job.pdf_path)
+        try:
+            info = await run_in_threadpool(inspect_pdf, path, text_needed)
+        except FileNotFoundError:
+            raise PermanentJobError(f"{job.pdf_path} is missing")
+        expected = blob_digest(path)
+        if expected and expected != info["sha256"]:
+            raise PermanentJobError(f"Checksum mismatch: {job.pdf_path} hashes to {info['sha256']}")
+        if metadata is None:
+            db.add(models.PdfMetadata(
+                pdf_path=job.pdf_path, sha256=info["sha256"], size=info["size"],
+                page_count=info["page_count"], title=info["title"], author=info["author"],
+                producer=info["producer"], processed_at=datetime.utcnow(),
+            ))
+        pdf_text = info["text"]
+    await hold_writes(db)
+    if text_needed:
+        await index_paper(db, paper.id, pdf_text)
+        return True
+    return False
+
+async def release_old_blob(db, job) -> bool:
+    """Delete a replaced or orphaned PDF once no paper references it."""
+    if await release_blob(db, job.pdf_path):
+        await hold_writes(db)
+        await db.execute(delete(models.PdfMetadata).where(models.PdfMetadata.pdf_path == job.pdf_path))
+    elif (await count_references(db, job.pdf_path) == 0
+          and await run_in_threadpool(resolve_pdf_path(job.pdf_path).exists)):
+        # Touched by an identical upload moments ago; look again after the grace period
+        raise RetryLater("Blob is inside its grace period", BLOB_GRACE_SECONDS)
+    return False
+
+HANDLERS = {
+    "process_pdf": process_pdf,
+    "release_blob": release_old_blob,
+}
+
+
+class JobQueue:
+    """Pool of asyncio workers running the jobs stored in paper_jobs.
+
+    Jobs are claimed with a compare-and-set UPDATE, so every web process and
+    any standalone `python jobs.py work` can share the table. Jobs left
+    running by a crashed process are requeued once their lease runs out, so
+    handlers must be safe to run twice.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, session_factory=AsyncSessionLocal):
+        self.workers = workers
+        self._session_factory = session_factory
+        self._tasks = []
+        self._wake = None
+        self._stopping = False
+        self._last_sweep = 0.0
+        self.worker_id = None
+        self.running = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self, wait_for=None):
+        """Spawn the workers on the running loop, after awaiting wait_for() if given."""
+        if self._tasks or self.workers <= 0:
+            return
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._work(wait_for)) for _ in range(self.workers)]
+
+    def notify(self):
+        """Wake idle workers in this process; call after committing new jobs."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def drain(self, timeout: float = JOB_DRAIN_TIMEOUT):
+        """Stop claiming jobs and let running ones finish; unfinished ones go back to the queue."""
+        if not self._tasks:
+            return
+        self._stopping = True
+        self.notify()
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        self._tasks = []
+
+    async def _work(self, wait_for):
+        if wait_for is not None:
+            await wait_for()
+        while not self._stopping:
+            try:
+                await self._sweep()
+                job = await self._claim()
+            except Exception:
+                logger.exception("Job queue unavailable, retrying in %ss", JOB_POLL_INTERVAL)
+                job = None
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _claim(self):
+        now = datetime.utcnow()
+        async with self._session_factory() as db:
+            candidates = (await db.scalars(
+                select(models.PaperJob.id)
+                .where(models.PaperJob.status == "queued", models.PaperJob.run_after <= now)
+                .order_by(models.PaperJob.id)
+                .limit(self.workers)
+            )).all()
+            for job_id in candidates:
+                # Another worker may have taken it since the SELECT, or run it and
+                # requeued it with a backoff that hasn't passed yet
+                async with serialized_writes():
+                    claimed = await db.execute(
+                        update(models.PaperJob)
+                        .where(models.PaperJob.id == job_id, models.PaperJob.status == "queued",
+                               models.PaperJob.run_after <= now)
+                        .values(status="running", attempts=models.PaperJob.attempts + 1,
+                                locked_at=now, worker=self.worker_id)
+                    )
+                    await db.commit()
+                if claimed.rowcount == 1:
+                    return await db.get(models.PaperJob, job_id)
+        return None
+
+    async def _run(self, job):
+        self.running += 1
+        try:
+            async with self._session_factory() as db:
+                try:
+                    handler = HANDLERS.get(job.kind)
+                    if handler is None:
+                        raise PermanentJobError(f"Unknown job kind {job.kind!r}")
+                    changed = await handler(db, job)
+                    await hold_writes(db)
+                    await db.execute(
+                        update(models.PaperJob)
+                        .where(models.PaperJob.id == job.id)
+                        .values(status="done", finished_at=datetime.utcnow(), locked_at=None, last_error=None)
+                    )
+                    await db.commit()
+                except asyncio.CancelledError:
+                    # Drain timed out: hand the job back without counting the attempt
+                    await db.rollback()
+                    await self._finish(db, job, status="queued", attempts=job.attempts - 1)
+                    raise
+                except Exception as e:
+                    await db.rollback()
+                    await self._fail(db, job, e)
+                    return
+            self.completed += 1
+            if changed:
+                paper_cache.invalidate()
+        finally:
+            self.running -= 1
+
+    async def _fail(self, db, job, error: Exception):
+        message = str(error) or repr(error)
+        if isinstance(error, PermanentJobError) or job.attempts >= JOB_MAX_ATTEMPTS:
+            self.failed += 1
+            logger.error("Job %s (%s, paper %s) failed: %s", job.id, job.kind, job.paper_id, message,
+                         exc_info=not isinstance(error, PermanentJobError))
+            await self._finish(db, job, status="failed", finished_at=datetime.utcnow(), last_error=message)
+            return
+        delay = error.delay if isinstance(error, RetryLater) else JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        self.retried += 1
+        logger.warning("Job %s (%s) attempt %d failed, retrying in %ss: %s",
+                       job.id, job.kind, job.attempts, delay, message)
+        await self._finish(db, job, status="queued", last_error=message,
+                           run_after=datetime.utcnow() + timedelta(seconds=delay))
+
+    async def _finish(self, db, job, **values):
+        async with serialized_writes():
+            await db.execute(
+                update(models.PaperJob)
+                .where(models.PaperJob.id == job.id)
+                .values(locked_at=None, worker=None, **values)
+            )
+            await db.commit()
+
+    async def _sweep(self):
+        # Requeue jobs whose worker died and drop old finished ones, once a minute per process
+        if time.monotonic() - self._last_sweep < JOB_SWEEP_INTERVAL:
+            return
+        self._last_sweep = time.monotonic()
+        now = datetime.utcnow()
+        expired = (models.PaperJob.status == "running") & (
+            models.PaperJob.locked_at < now - timedelta(seconds=JOB_LEASE_SECONDS))
+        async with self._session_factory() as db, serialized_writes():
+            await db.execute(
+                update(models.PaperJob)
+                .where(expired, models.PaperJob.attempts >= JOB_MAX_ATTEMPTS)
+                .values(status="failed", finished_at=now, locked_at=None, last_error="Lease expired")
+            )
+            await db.execute(
+                update(models.PaperJob).where(expired).values(status="queued", locked_at=None, worker=None)
+            )
+            await db.execute(
+                delete(models.PaperJob)
+                .where(models.PaperJob.status == "done",
+                       models.PaperJob.finished_at < now - timedelta(days=JOB_RETENTION_DAYS))
+            )
+            await db.commit()
+
+    def metrics(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "running": self.running,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+job_queue = JobQueue()
+
+
+async def _work_until_signalled():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    job_queue.start()
+    await stop.wait()
+    await job_queue.drain()
+
+async def _retry_failed(paper_id=None) -> int:
+    query = update(models.PaperJob).where(models.PaperJob.status == "failed")
+    if paper_id is not None:
+        query = query.where(models.PaperJob.paper_id == paper_id)
+    async with AsyncSessionLocal() as db, serialized_writes():
+        result = await db.execute(query.values(status="queued", attempts=0, run_after=datetime.utcnow(),
+                                               finished_at=None))
+        await db.commit()
+    return result.rowcount
+
+async def _status_counts() -> dict:
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(
+            select(models.PaperJob.status, func.count()).group_by(models.PaperJob.status)
+        )
+        return dict(rows.all())
+
+
+if __name__ == "__main__":
+    from database import async_engine, create_tables
+
+    parser = argparse.ArgumentParser(description="Run or inspect the background paper job queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+    work_parser = commands.add_parser("work", help="run workers until SIGINT/SIGTERM, then drain")
+    work_parser.add_argument("--workers", type=int, default=max(1, JOB_WORKERS))
+    retry_parser = commands.add_parser("retry-failed", help="queue failed jobs again")
+    retry_parser.add_argument("--paper-id", type=int)
+    commands.add_parser("status", help="count jobs per status")
+    args = parser.parse_args()
+
+    async def main():
+        try:
+            if args.command == "work":
+                logging.basicConfig(level=logging.INFO)
+                job_queue.workers = args.workers
+                await _work_until_signalled()
+            elif args.command == "retry-failed":
+                print({"requeued": await _retry_failed(args.paper_id)})
+            else:
+                print(await _status_counts())
+        finally:
+            await async_engine.dispose()
+
+    create_tables()
+    asyncio.run(main())
@@ -1,26 +1,45 @@
 # Remove duplicate imports
 import os
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import TypeAdapter
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
-import jwt
-from jwt.exceptions import PyJWTError
-from typing import List
-import shutil
-from pathlib import Path
-from database import create_tables, get_db, engine
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Union
+from database import create_tables, get_db, engine, async_engine, serialized_writes
 import models
 import schemas
-from passlib.context import CryptContext
+from auth_cache import token_cache, user_cache, token_key, invalidate_user, sync_invalidations, cache_stats
+from storage import UPLOAD_DIR, receive_pdf, store_blob
+from http_cache import RangeFileResponse, accel_redirect_response, http_date, is_not_modified, is_partial_range, not_modified_response
+from response_cache import CachedResponse, paper_cache
+from fast_json import FAST_JSON, RawJSONResponse, dumps, fetch_paper_rows, fetch_submission_rows
+from instrumentation import InstrumentationMiddleware, instrument_engine, metrics, timed
+from search import KEEP, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT, build_search_index, index_paper, known_pdf_text, remove_paper, search_papers
+from jobs import enqueue, job_queue, paper_jobs
+from question_import import ImportFormatError, detect_format, import_questions
+from progress import record_submission, record_submissions, get_user_progress, backfill_progress_stats, rebuild_paper_stats
+from history import SUBMISSIONS_CURSOR_HEADER, SUBMISSIONS_MAX_PAGE_SIZE, SUBMISSIONS_PAGE_SIZE, encode_cursor, submission_buckets, submission_page
+from grading import answer_keys, dump_answers, load_answer_keys, regrade_paper
+from exports import export_response, papers_export_query, submissions_export_query
+from attempts import AttemptClosed, autosave_buffer, start_attempt
+from pdf_links import PDF_LINK_SECRET, PdfLinkSigner, PdfNotFound, pdf_locations
+from scores import SCORE_TOP_MAX, reset_scores, score_index
+from hashing import HashingPoolBusy, hashing_pool, get_password_hash, verify_and_update_password
 from fastapi.middleware.cors import CORSMiddleware
-import bcrypt
-from fastapi import Request
+from fastapi import Request, Response
 from fastapi.security import APIKeyHeader
+from startup import STARTUP_MODE, ReadinessMiddleware, StartupGate, lazy_import
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
+# Loaded on first use to keep cold starts short
+jwt = lazy_import("jwt")
+from shared_state import RATE_LIMIT_STORAGE_URI
+
 # Single instance of FastAPI
 app = FastAPI()
 
@@ -31,34 +50,74 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-After-Id", "X-Next-Cursor", "ETag", "Accept-Ranges", "Content-Range", "Content-Length"],
 )
 
 # Single instance of configurations
 SECRET_KEY = "123"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Paper listing pagination; the next page's after_id is sent in NEXT_CURSOR_HEADER
+PAPERS_PAGE_SIZE = 50
+PAPERS_MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = "X-Next-After-Id"
+pdf_link_signer = PdfLinkSigner(PDF_LINK_SECRET or SECRET_KEY)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-# Update the pwd_context configuration
-pwd_context = CryptContext(
-    schemes=["bcrypt"],
-    deprecated="auto",
-    bcrypt__rounds=12
-)
+# Password hashing lives in hashing.py and runs on a bounded process pool
+
+@app.exception_handler(HashingPoolBusy)
+async def hashing_pool_busy_handler(request: Request, exc: HashingPoolBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
-# Update the password hashing function
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+def prepare_storage():
+    # One-off setup: PDF directory, schema check, progress and search backfills
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    create_tables()
+    backfill_progress_stats(engine)
+    build_search_index(engine)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# Requests wait at the gate until prepare_storage has run (STARTUP_MODE in startup.py)
+startup_gate = StartupGate(prepare_storage)
+app.add_middleware(ReadinessMiddleware, gate=startup_gate)
 
-# Single instance of PDF directory
-# Define upload directory
-UPLOAD_DIR = Path("uploads/pdfs")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+# Outermost, so time spent waiting at the gate is part of the measured latency
+app.add_middleware(InstrumentationMiddleware)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+metrics.add_collector("hashing_pool", hashing_pool.metrics)
+metrics.add_collector("auth_cache", cache_stats)
+metrics.add_collector("response_cache", lambda: {"papers": paper_cache.stats()})
+metrics.add_collector("jobs", job_queue.metrics)
+metrics.add_collector("answer_key_cache", answer_keys.stats)
+metrics.add_collector("autosave", autosave_buffer.metrics)
+metrics.add_collector("pdf_location_cache", pdf_locations.stats)
+metrics.add_collector("score_index", score_index.metrics)
+if STARTUP_MODE == "eager":
+    startup_gate.run_sync()
 
-# Create tables once
-create_tables()
+@app.on_event("startup")
+async def begin_startup():
+    # Fast mode: the port opens right away and preparation overlaps the first requests
+    startup_gate.start()
+    # PDF processing and blob deletion run off the request path (jobs.py)
+    job_queue.start(wait_for=startup_gate.wait)
+    # Exam autosaves are buffered in memory and written in batches (attempts.py)
+    autosave_buffer.start()
+    # Score distributions are snapshotted periodically so restarts start warm (scores.py)
+    score_index.start()
+
+@app.on_event("shutdown")
+async def dispose_engines():
+    await job_queue.drain()
+    await autosave_buffer.drain()
+    await score_index.drain()
+    # Close pooled aiosqlite connections so their worker threads exit
+    await async_engine.dispose()
+    hashing_pool.shutdown()
 
 # Keep all your helper functions together
 # Remove duplicate function definitions
@@ -75,24 +134,42 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 # Keep authentication functions together
-# Update the jwt import
-from jwt.exceptions import PyJWTError
+def decode_token_subject(token: str) -> str:
+    # Signature is only checked on a cache miss; hits are valid until "exp"
+    key = token_key(token)
+    username = token_cache.get(key)
+    if username is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username = payload.get("sub")
+        if username is None:
+            raise jwt.InvalidTokenError("Token has no subject")
+        token_cache.set(key, username, expires_at=payload.get("exp"))
+    return username
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_cached_user(db: AsyncSession, username: str):
+    # Snapshot of the user row, refreshed after USER_CACHE_TTL or invalidate_user()
+    sync_invalidations()
+    user = user_cache.get(username)
+    if user is None:
+        db_user = await db.scalar(select(models.User).where(models.User.username == username))
+        if db_user is None:
+            return None
+        user = schemas.User.model_validate(db_user)
+        user_cache.set(username, user)
+    return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except PyJWTError:  # Changed from JWTError to PyJWTError
+        username = decode_token_subject(token)
+    except jwt.PyJWTError:  # Changed from JWTError to PyJWTError
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.username == username).first()
+    user = await get_cached_user(db, username)
     if user is None:
         raise credentials_exception
     return user
@@ -102,12 +179,23 @@ async def get_current_active_user(current_user: schemas.User = Depends(get_curre
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
+async def save_pdf(pending):
+    """Store a received upload, turning a disk error into a 500 instead of a dropped connection."""
+    try:
+        return await store_blob(pending)
+    except OSError:
+        await pending.discard()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to save PDF file"
+        )
+
 # Keep all your endpoints together
 @app.post("/papers/{paper_id}/upload-pdf", response_model=schemas.PaperUploadResponse)
 async def upload_pdf(
     paper_id: int,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     # Verify admin access
@@ -118,101 +206,148 @@ async def upload_pdf(
         )
     
     # Check if paper exists
-    paper = db.query(models.Paper).filter(models.Paper.id == paper_id).first()
+    paper = await db.get(models.Paper, paper_id)
     if not paper:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Paper not found"
         )
     
-    # Validate file is PDF
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="File must be a PDF document"
-        )
-    
-    # Validate file size (e.g., 10MB max)
-    MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-    file.file.seek(0, 2)  # Move to end of file
-    file_size = file.file.tell()
-    file.file.seek(0)  # Reset file pointer
-    if file_size > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail="File size exceeds 10MB limit"
-        )
-    
-    # Create unique filename with paper_id to avoid conflicts
-    filename = f"paper_{paper_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-    file_path = UPLOAD_DIR / filename
-    
-    # Save the uploaded file
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Stream, validate (type, signature, 10MB cap) and checksum the upload
+    pending = await receive_pdf(file)
+    file_path = await save_pdf(pending)
     
     # Update paper with pdf_path
-    paper.pdf_path = str(file_path)
-    db.commit()
-    db.refresh(paper)
+    old_pdf_path = paper.pdf_path
+    paper.pdf_path = file_path.as_posix()
+    # Text of an already indexed blob is reused; otherwise the job extracts it
+    pdf_text = await known_pdf_text(db, paper.pdf_path) or ""
+    async with serialized_writes():
+        await index_paper(db, paper.id, pdf_text)
+        enqueue(db, "process_pdf", paper.id, paper.pdf_path)
+        if old_pdf_path and old_pdf_path != paper.pdf_path:
+            enqueue(db, "release_blob", paper.id, old_pdf_path)
+        await db.commit()
+    paper_cache.invalidate()
+    job_queue.notify()
     
     return {
         "paper_id": paper.id,
         "title": paper.title,
-        "pdf_path": paper.pdf_path
+        "pdf_path": paper.pdf_path,
+        "size": pending.size,
+        "sha256": pending.sha256,
+        "deduplicated": pending.deduplicated
     }
 
-limiter = Limiter(key_func=get_remote_address)
+# Counters live in the SQLite file shared by all workers when WEB_CONCURRENCY > 1
+limiter = Limiter(key_func=get_remote_address, storage_uri=RATE_LIMIT_STORAGE_URI)
+
+# Browsers may reuse a PDF for this long before revalidating with If-None-Match
+PDF_CACHE_CONTROL = f"private, max-age={int(os.getenv('PDF_CACHE_MAX_AGE', '300'))}, must-revalidate"
+
+def pdf_request_cost(request: Request) -> int:
+    # Revalidations answered with 304 and viewer fetches of part of the file
+    # don't use up the download budget. Runs before the endpoint, so it can
+    # only judge by a cached location; anything else costs a download.
+    location = pdf_locations.peek(int(request.path_params["paper_id"]))
+    if location is None:
+        return 1
+    stat = location.stat
+    if is_not_modified(request, location.etag, stat.st_mtime):
+        return 0
+    return 0 if is_partial_range(request, location.etag, stat.st_mtime, stat.st_size) else 1
+
+async def get_pdf_location(db, paper_id: int):
+    try:
+        return await pdf_locations.get(db, paper_id)
+    except PdfNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+def pdf_file_response(request: Request, paper_id: int, location):
+    # Blobs are named by their SHA-256, which makes a strong validator
+    cache_headers = {
+        "Cache-Control": PDF_CACHE_CONTROL,
+        "Last-Modified": http_date(location.stat.st_mtime),
+    }
+    if location.etag:
+        cache_headers["ETag"] = location.etag
+    if is_not_modified(request, location.etag, location.stat.st_mtime):
+        return not_modified_response(cache_headers)
+    
+    if location.accel_uri:
+        # nginx sends the file (ranges included) from its internal location
+        cache_headers["Content-Disposition"] = f'attachment; filename="paper_{paper_id}.pdf"'
+        return accel_redirect_response(location.accel_uri, "application/pdf", cache_headers)
+    # Range/If-Range requests are answered with 206 (single or multipart/byteranges) or 416
+    return RangeFileResponse(
+        path=location.path,
+        media_type="application/pdf",
+        filename=f"paper_{paper_id}.pdf",
+        headers=cache_headers,
+        stat_result=location.stat
+    )
 
 @app.get("/papers/{paper_id}/pdf")
-@limiter.limit("5/minute")  # 5 requests per minute
+@limiter.limit("5/minute", cost=pdf_request_cost)  # 5 requests per minute
 async def get_pdf(
     request: Request,
     paper_id: int,
     token: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
         # Verify token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        # Get user
-        user = db.query(models.User).filter(models.User.username == username).first()
-        if not user or not user.is_active:
-            raise HTTPException(status_code=401, detail="Invalid user")
-        
-        # Get paper
-        paper = db.query(models.Paper).filter(models.Paper.id == paper_id).first()
-        if not paper:
-            raise HTTPException(status_code=404, detail="Paper not found")
-        
-        if not paper.pdf_path:
-            raise HTTPException(status_code=404, detail="PDF not found for this paper")
-        
-        pdf_path = Path(paper.pdf_path)
-        if not pdf_path.exists():
-            raise HTTPException(status_code=404, detail="PDF file not found on server")
-        
-        return FileResponse(
-            path=pdf_path,
-            media_type="application/pdf",
-            filename=f"paper_{paper_id}.pdf"
-        )
-        
+        username = decode_token_subject(token)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
+    except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    
+    # Get user
+    user = await get_cached_user(db, username)
+    if not user or not user.is_active:
+        raise HTTPException(status_code=401, detail="Invalid user")
+    
+    return pdf_file_response(request, paper_id, await get_pdf_location(db, paper_id))
+
+@app.get("/papers/{paper_id}/pdf-link", response_model=schemas.PdfLink)
+async def create_pdf_link(
+    request: Request,
+    paper_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    await get_pdf_location(db, paper_id)
+    expires, signature = pdf_link_signer.issue(paper_id, current_user.id)
+    url = request.url_for("get_signed_pdf", paper_id=paper_id).include_query_params(
+        user=current_user.id, expires=expires, signature=signature
+    )
+    return {"url": str(url), "expires_at": datetime.fromtimestamp(expires, timezone.utc)}
+
+@app.get("/papers/{paper_id}/pdf/signed")
+async def get_signed_pdf(
+    request: Request,
+    paper_id: int,
+    user: int,
+    expires: int,
+    signature: str,
+    db: AsyncSession = Depends(get_db)
+):
+    # The signature stands in for the JWT, user lookup and rate limit of get_pdf;
+    # with a warm location cache this touches neither the database nor the disk
+    if not pdf_link_signer.verify(paper_id, user, expires, signature):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired link")
+    return pdf_file_response(request, paper_id, await get_pdf_location(db, paper_id))
 
 @app.post("/register", response_model=schemas.User)
-async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     try:
-        db_user = db.query(models.User).filter(models.User.email == user.email).first()
+        db_user = await db.scalar(select(models.User).where(models.User.email == user.email))
         if db_user:
             raise HTTPException(status_code=400, detail="Email already registered")
         
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await get_password_hash(user.password)
         db_user = models.User(
             email=user.email,
             username=user.username,
@@ -221,23 +356,37 @@ async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db))
             is_admin=False
         )
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        async with serialized_writes():
+            await db.commit()
+        await db.refresh(db_user)
         return db_user
     except Exception as e:
         print(f"Registration error: {str(e)}")  # This will log the error
         raise
 
 @app.post("/token", response_model=schemas.Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(models.User).where(models.User.username == form_data.username))
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    valid, new_hash = await verify_and_update_password(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Opportunistically upgrade hashes made with an older bcrypt__rounds
+    if new_hash:
+        user.hashed_password = new_hash
+        async with serialized_writes():
+            await db.commit()
+    
     access_token = create_access_token(data={"sub": user.username})
     return {
         "access_token": access_token, 
@@ -248,24 +397,13 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
 
 
 @app.post("/papers/", response_model=schemas.Paper)
-# Move validate_pdf_file before all route handlers
-async def validate_pdf_file(file: UploadFile) -> bool:
-    # Check file extension
-    if not file.filename.lower().endswith('.pdf'):
-        return False
-    
-    # Read first few bytes to verify PDF signature
-    content = await file.read(5)
-    await file.seek(0)  # Reset file pointer
-    return content.startswith(b'%PDF-')
-
 async def create_paper(
     title: str = Form(...),
     description: str = Form(...),
     duration_minutes: int = Form(...),
     total_marks: int = Form(...),
     pdf_file: UploadFile = File(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     if not current_user.is_admin:
@@ -274,42 +412,32 @@ async def create_paper(
             detail="Not authorized to create papers"
         )
     
+    # Store the PDF before creating the row so a bad file leaves no orphan paper
+    file_path = None
+    if pdf_file:
+        pending = await receive_pdf(pdf_file)
+        file_path = await save_pdf(pending)
+    
     # Create paper in database
     paper_data = {
         "title": title,
         "description": description,
         "duration_minutes": duration_minutes,
-        "total_marks": total_marks
+        "total_marks": total_marks,
+        "pdf_path": file_path.as_posix() if file_path else None
     }
+    pdf_text = await known_pdf_text(db, paper_data["pdf_path"]) or ""
     db_paper = models.Paper(**paper_data)
     db.add(db_paper)
-    db.commit()
-    db.refresh(db_paper)
-
-    # Handle PDF upload if provided
-    if pdf_file:
-        if not await validate_pdf_file(pdf_file):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid PDF file format"
-            )
-        
-        try:
-            filename = f"paper_{db_paper.id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-            file_path = UPLOAD_DIR / filename
-            
-            with file_path.open("wb") as buffer:
-                content = await pdf_file.read()
-                buffer.write(content)
-            
-            db_paper.pdf_path = str(file_path)
-            db.commit()
-            db.refresh(db_paper)
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to save PDF file"
-            )
+    async with serialized_writes():
+        await db.flush()
+        await index_paper(db, db_paper.id, pdf_text)
+        if db_paper.pdf_path:
+            enqueue(db, "process_pdf", db_paper.id, db_paper.pdf_path)
+        await db.commit()
+    paper_cache.invalidate()
+    job_queue.notify()
+    await db.refresh(db_paper, ["questions"])
     
     return db_paper
 
@@ -321,7 +449,7 @@ async def update_paper(
     duration_minutes: int = Form(...),
     total_marks: int = Form(...),
     pdf_file: UploadFile = File(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     if not current_user.is_admin:
@@ -330,7 +458,11 @@ async def update_paper(
             detail="Not authorized to update papers"
         )
     
-    paper = db.query(models.Paper).filter(models.Paper.id == paper_id).first()
+    paper = await db.scalar(
+        select(models.Paper)
+        .where(models.Paper.id == paper_id)
+        .options(selectinload(models.Paper.questions))
+    )
     if not paper:
         raise HTTPException(status_code=404, detail="Paper not found")
     
@@ -341,91 +473,552 @@ async def update_paper(
     paper.total_marks = total_marks
 
     # Handle PDF upload if provided
+    old_pdf_path = None
+    pdf_text = KEEP
     if pdf_file:
-        # Delete old PDF if exists
-        if paper.pdf_path:
-            old_path = Path(paper.pdf_path)
-            if old_path.exists():
-                old_path.unlink()
-        
         # Save new PDF
-        filename = f"paper_{paper_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-        file_path = UPLOAD_DIR / filename
-        
-        with file_path.open("wb") as buffer:
-            content = await pdf_file.read()
-            buffer.write(content)
-        
-        paper.pdf_path = str(file_path)
+        pending = await receive_pdf(pdf_file)
+        file_path = await save_pdf(pending)
+        old_pdf_path = paper.pdf_path
+        paper.pdf_path = file_path.as_posix()
+        pdf_text = await known_pdf_text(db, paper.pdf_path) or ""
+        enqueue(db, "process_pdf", paper.id, paper.pdf_path)
+        # The old PDF is deleted by a job, after this commit
+        if old_pdf_path and old_pdf_path != paper.pdf_path:
+            enqueue(db, "release_blob", paper.id, old_pdf_path)
     
-    db.commit()
-    db.refresh(paper)
+    async with serialized_writes():
+        await index_paper(db, paper.id, pdf_text)
+        await db.commit()
+    paper_cache.invalidate()
+    job_queue.notify()
     return paper
 
-@app.get("/papers/", response_model=List[schemas.Paper])
+@app.post("/papers/{paper_id}/questions/import", response_model=schemas.QuestionImportResult)
+async def import_paper_questions(
+    paper_id: int,
+    file: UploadFile = File(...),
+    file_format: Optional[str] = Query(None, alias="format", pattern="^(csv|ndjson)$"),
+    dry_run: bool = False,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to import questions"
+        )
+    
+    paper = await db.get(models.Paper, paper_id)
+    if not paper:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    
+    # CSV needs a question_text,answer,marks header; NDJSON has one object per line
+    await file.seek(0)
+    try:
+        result = await import_questions(db, paper_id, file.file, detect_format(file.filename, file_format), dry_run)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception:
+        # Batches committed before the failure are kept, so the cached key and papers are stale
+        answer_keys.invalidate(paper_id)
+        paper_cache.invalidate()
+        raise
+    
+    if result["imported"] and not dry_run:
+        # Index the new question text once, not per batch
+        async with serialized_writes():
+            await index_paper(db, paper_id)
+            await db.commit()
+        answer_keys.invalidate(paper_id)
+        paper_cache.invalidate()
+    return result
+
+@app.put("/questions/{question_id}", response_model=schemas.Question)
+async def update_question(
+    question_id: int,
+    changes: schemas.QuestionUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to update questions"
+        )
+    
+    question = await db.get(models.Question, question_id)
+    if not question:
+        raise HTTPException(status_code=404, detail="Question not found")
+    
+    for field, value in changes.model_dump(exclude_none=True).items():
+        setattr(question, field, value)
+    async with serialized_writes():
+        await index_paper(db, question.paper_id)
+        await db.commit()
+    # Existing attempts keep their marks until POST /papers/{id}/regrade
+    answer_keys.invalidate(question.paper_id)
+    paper_cache.invalidate()
+    return question
+
+@app.post("/papers/{paper_id}/regrade", response_model=schemas.RegradeResult)
+async def regrade_submissions(
+    paper_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to regrade papers"
+        )
+    
+    paper = await db.get(models.Paper, paper_id)
+    if not paper:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    
+    # Mark against the key as stored right now rather than a cached copy
+    answer_key = (await load_answer_keys(db, [paper_id]))[paper_id]
+    result = await regrade_paper(db, paper_id, answer_key)
+    async with serialized_writes():
+        await rebuild_paper_stats(db, paper_id)
+        await reset_scores(db, paper_id)
+        await db.commit()
+    score_index.invalidate(paper_id)
+    return result
+
+# Catalogue reads are answered from paper_cache; the writers above invalidate it
+# Only admins see answers; students get the same papers without them
+paper_list_adapter = TypeAdapter(List[schemas.Paper])
+student_paper_list_adapter = TypeAdapter(List[schemas.StudentPaper])
+paper_summary_list_adapter = TypeAdapter(List[schemas.PaperSummary])
+search_result_adapter = TypeAdapter(List[schemas.PaperSearchResult])
+
+@app.get("/papers/", response_model=List[Union[schemas.Paper, schemas.StudentPaper]])
 async def get_papers(
-    db: Session = Depends(get_db),
+    request: Request,
+    limit: int = Query(PAPERS_PAGE_SIZE, ge=1, le=PAPERS_MAX_PAGE_SIZE),
+    after_id: Optional[int] = None,
+    include_questions: bool = True,
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
+    cache_key = ("list", current_user.is_admin, limit, after_id, include_questions)
+    cached = paper_cache.get(cache_key)
+    if cached is not None:
+        return cached.to_response(request)
+    version = paper_cache.version
     try:
-        papers = db.query(models.Paper).all()
-        return papers
+        # Keyset pagination on id; one extra row tells us if there is a next page
+        if FAST_JSON:
+            papers = await fetch_paper_rows(db, limit, after_id, include_questions, current_user.is_admin)
+            page = papers[:limit]
+            with timed("serialize"):
+                body = dumps(page)
+            last_id = page[-1]["id"] if page else None
+        else:
+            query = select(models.Paper).order_by(models.Paper.id).limit(limit + 1)
+            if after_id is not None:
+                query = query.where(models.Paper.id > after_id)
+            if include_questions:
+                # One batched IN query for all questions on the page instead of one per paper
+                query = query.options(selectinload(models.Paper.questions))
+            papers = (await db.scalars(query)).all()
+            page = papers[:limit]
+            if not include_questions:
+                adapter = paper_summary_list_adapter
+            elif current_user.is_admin:
+                adapter = paper_list_adapter
+            else:
+                adapter = student_paper_list_adapter
+            with timed("serialize"):
+                body = adapter.dump_json(page)
+            last_id = page[-1].id if page else None
+        
+        headers = {}
+        if len(papers) > limit:
+            headers[NEXT_CURSOR_HEADER] = str(last_id)
+        entry = CachedResponse(body, headers)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to fetch papers"
         )
+    return paper_cache.set(cache_key, version, entry).to_response(request)
+
+async def record_paper_submission(db, paper_id: int, user_id: int, time_spent: int, marks, answers, submitted_at):
+    """Mark an attempt (papers with questions) and add it with its aggregates, without committing."""
+    # Papers with questions are marked here; client marks only count for PDF-only papers
+    answer_key = await answer_keys.get(db, paper_id)
+    if answer_key:
+        if answers is None:
+            raise HTTPException(status_code=422, detail="Answers are required for this paper")
+        marks = answer_key.grade(answers)
+    elif marks is None:
+        raise HTTPException(status_code=422, detail="Marks are required for this paper")
+    
+    paper_submission = models.PaperSubmission(
+        paper_id=paper_id,
+        user_id=user_id,
+        time_spent=time_spent,
+        marks=marks,
+        submitted_at=submitted_at
+    )
+    
+    db.add(paper_submission)
+    if answer_key:
+        # Kept so the attempt can be re-marked after an answer-key fix
+        await db.flush()
+        db.add(models.SubmissionAnswers(
+            submission_id=paper_submission.id,
+            paper_id=paper_id,
+            answers=dump_answers(answers),
+            key_version=answer_key.version
+        ))
+    # Keep the per-user aggregates in the same transaction as the submission
+    await record_submission(db, paper_submission)
+    return paper_submission
 
 @app.post("/papers/{paper_id}/submit", response_model=schemas.PaperSubmission)
 async def submit_paper(
     paper_id: int,
     submission: schemas.PaperSubmissionCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
-    paper = db.query(models.Paper).filter(models.Paper.id == paper_id).first()
+    paper = await db.get(models.Paper, paper_id)
     if not paper:
         raise HTTPException(status_code=404, detail="Paper not found")
     
-    paper_submission = models.PaperSubmission(
-        paper_id=paper_id,
-        user_id=current_user.id,
-        time_spent=submission.time_spent,
-        marks=submission.marks,
-        submitted_at=datetime.utcnow()
-    )
+    async with serialized_writes():
+        paper_submission = await record_paper_submission(
+            db, paper_id, current_user.id, submission.time_spent, submission.marks, submission.answers,
+            datetime.utcnow()
+        )
+        await db.commit()
+    score_index.record(paper_id, paper_submission.id, paper_submission.marks)
+    return paper_submission
+
+@app.post("/papers/submissions/batch", response_model=schemas.PaperSubmissionBatchResult)
+async def submit_paper_batch(
+    batch: schemas.PaperSubmissionBatch,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    items = batch.submissions
     
-    db.add(paper_submission)
-    db.commit()
-    db.refresh(paper_submission)
+    # Validate every referenced paper with a single query
+    paper_ids = {item.paper_id for item in items}
+    existing = set((await db.scalars(
+        select(models.Paper.id).where(models.Paper.id.in_(paper_ids))
+    )).all())
+    keys = await answer_keys.get_many(db, existing)
+    
+    now = datetime.utcnow()
+    results = []
+    rows = []
+    graded = {}  # paper_id -> [(row index, answers)]
+    for index, item in enumerate(items):
+        if item.paper_id not in existing:
+            results.append({"index": index, "paper_id": item.paper_id, "status": "rejected", "detail": "Paper not found"})
+            continue
+        answer_key = keys[item.paper_id]
+        if answer_key and item.answers is None:
+            results.append({"index": index, "paper_id": item.paper_id, "status": "rejected", "detail": "Answers are required for this paper"})
+            continue
+        if not answer_key and item.marks is None:
+            results.append({"index": index, "paper_id": item.paper_id, "status": "rejected", "detail": "Marks are required for this paper"})
+            continue
+        if answer_key:
+            graded.setdefault(item.paper_id, []).append((len(rows), item.answers))
+        submitted_at = item.submitted_at or now
+        if submitted_at.tzinfo is not None:
+            submitted_at = submitted_at.astimezone(timezone.utc).replace(tzinfo=None)
+        rows.append({
+            "paper_id": item.paper_id,
+            "user_id": current_user.id,
+            "time_spent": item.time_spent,
+            "marks": item.marks,
+            "submitted_at": submitted_at
+        })
+        results.append({"index": index, "paper_id": item.paper_id, "status": "created"})
+    
+    # Each paper's attempts are marked in one pass over its answer key
+    for paper_id, entries in graded.items():
+        marks = keys[paper_id].grade_many([answers for _, answers in entries])
+        for (row_index, _), row_marks in zip(entries, marks):
+            rows[row_index]["marks"] = row_marks
+    
+    if rows:
+        # One multi-row INSERT for the whole batch, plus one upsert for the aggregates
+        async with serialized_writes():
+            ids = (await db.scalars(
+                insert(models.PaperSubmission).returning(models.PaperSubmission.id, sort_by_parameter_order=True),
+                rows
+            )).all()
+            answer_rows = [
+                {
+                    "submission_id": ids[row_index],
+                    "paper_id": paper_id,
+                    "answers": dump_answers(answers),
+                    "key_version": keys[paper_id].version
+                }
+                for paper_id, entries in graded.items()
+                for row_index, answers in entries
+            ]
+            if answer_rows:
+                await db.execute(insert(models.SubmissionAnswers), answer_rows)
+            await record_submissions(db, rows)
+            await db.commit()
+        created = iter(zip(ids, rows))
+        for result in results:
+            if result["status"] == "created":
+                result["id"], row = next(created)
+                result["marks"] = row["marks"]
+                score_index.record(row["paper_id"], result["id"], row["marks"])
+    
+    return {
+        "created": len(rows),
+        "rejected": len(items) - len(rows),
+        "results": results
+    }
+
+
+@app.post("/papers/{paper_id}/attempts", response_model=schemas.ExamAttempt)
+async def start_paper_attempt(
+    paper_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    paper = await db.get(models.Paper, paper_id)
+    if not paper:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    
+    # Resumes the open attempt after a crash or reload; the clock keeps running
+    now = datetime.utcnow()
+    attempt = await start_attempt(db, paper, current_user.id, now)
+    async with serialized_writes():
+        await db.commit()
+    return autosave_buffer.view(attempt, now)
+
+async def get_own_attempt_state(db, attempt_id: int, user_id: int):
+    state = await autosave_buffer.state(db, attempt_id)
+    if state is None or state.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Attempt not found")
+    return state
+
+@app.get("/attempts/{attempt_id}", response_model=schemas.ExamAttempt)
+async def get_attempt(
+    attempt_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    attempt = await db.get(models.ExamAttempt, attempt_id)
+    if attempt is None or attempt.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Attempt not found")
+    return autosave_buffer.view(attempt, datetime.utcnow())
+
+@app.put("/attempts/{attempt_id}/answers", response_model=schemas.AttemptStatus)
+async def autosave_attempt(
+    attempt_id: int,
+    save: schemas.AttemptAutosave,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    # Buffered and written in batches; the database is only read when the attempt isn't cached
+    state = await get_own_attempt_state(db, attempt_id, current_user.id)
+    now = datetime.utcnow()
+    try:
+        autosave_buffer.save(attempt_id, state, save.revision, save.answers, now)
+    except AttemptClosed as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return autosave_buffer.status(attempt_id, state, now)
+
+@app.post("/attempts/{attempt_id}/heartbeat", response_model=schemas.AttemptStatus)
+async def attempt_heartbeat(
+    attempt_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    state = await get_own_attempt_state(db, attempt_id, current_user.id)
+    now = datetime.utcnow()
+    try:
+        autosave_buffer.heartbeat(attempt_id, state, now)
+    except AttemptClosed as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return autosave_buffer.status(attempt_id, state, now)
+
+@app.post("/attempts/{attempt_id}/submit", response_model=schemas.PaperSubmission)
+async def submit_attempt(
+    attempt_id: int,
+    submission: schemas.AttemptSubmit,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    attempt = await db.get(models.ExamAttempt, attempt_id)
+    if attempt is None or attempt.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Attempt not found")
+    if attempt.status != "in_progress":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Attempt already submitted")
+    if await db.get(models.Paper, attempt.paper_id) is None:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    
+    # Time spent is measured on the server and stops at the deadline
+    now = datetime.utcnow()
+    answers, time_spent = autosave_buffer.final_answers(attempt, submission.answers, now)
+    async with serialized_writes():
+        paper_submission = await record_paper_submission(
+            db, attempt.paper_id, current_user.id, time_spent, submission.marks, answers, now
+        )
+        await db.flush()
+        # Compare-and-set, so a concurrent submit of the same attempt records nothing
+        closed = await db.execute(
+            update(models.ExamAttempt)
+            .where(models.ExamAttempt.id == attempt_id, models.ExamAttempt.status == "in_progress")
+            .values(status="submitted", submission_id=paper_submission.id, answers=dump_answers(answers),
+                    last_seen_at=now)
+        )
+        if closed.rowcount == 0:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Attempt already submitted")
+        await db.commit()
+    autosave_buffer.closed(attempt_id)
+    score_index.record(attempt.paper_id, paper_submission.id, paper_submission.marks)
     return paper_submission
 
 
-@app.get("/papers/{paper_id}", response_model=schemas.Paper)
+# Declared before /papers/{paper_id} so "search" isn't taken for an id
+@app.get("/papers/search", response_model=List[schemas.PaperSearchResult])
+async def search_catalogue(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    # Ranked with bm25 over title, description, question text and PDF text
+    cache_key = ("search", q, limit)
+    cached = paper_cache.get(cache_key)
+    if cached is not None:
+        return cached.to_response(request)
+    version = paper_cache.version
+    results = await search_papers(db, q, limit)
+    entry = CachedResponse(search_result_adapter.dump_json(search_result_adapter.validate_python(results)))
+    return paper_cache.set(cache_key, version, entry).to_response(request)
+
+@app.get("/papers/{paper_id}", response_model=Union[schemas.Paper, schemas.StudentPaper])
 async def get_paper(
+    request: Request,
     paper_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
-    paper = db.query(models.Paper).filter(models.Paper.id == paper_id).first()
+    cache_key = ("paper", current_user.is_admin, paper_id)
+    cached = paper_cache.get(cache_key)
+    if cached is not None:
+        return cached.to_response(request)
+    version = paper_cache.version
+    paper = await db.scalar(
+        select(models.Paper)
+        .where(models.Paper.id == paper_id)
+        .options(selectinload(models.Paper.questions))
+    )
     if paper is None:
         raise HTTPException(status_code=404, detail="Paper not found")
-    return paper
+    schema = schemas.Paper if current_user.is_admin else schemas.StudentPaper
+    entry = CachedResponse(schema.model_validate(paper).model_dump_json().encode())
+    return paper_cache.set(cache_key, version, entry).to_response(request)
+
+@app.get("/papers/{paper_id}/jobs", response_model=schemas.PaperProcessingStatus)
+async def get_paper_jobs(
+    paper_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view paper jobs"
+        )
+    
+    # Job history outlives the paper, so deleted papers still answer
+    paper = await db.get(models.Paper, paper_id)
+    jobs = await paper_jobs(db, paper_id)
+    if paper is None and not jobs:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    pdf_path = paper.pdf_path if paper else None
+    return {
+        "paper_id": paper_id,
+        "pdf_path": pdf_path,
+        "pdf": await db.get(models.PdfMetadata, pdf_path) if pdf_path else None,
+        "jobs": jobs
+    }
 
 @app.put("/users/{user_id}/admin", response_model=schemas.User)
 async def set_admin_status(
     user_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     user.is_admin = True
-    db.commit()
-    db.refresh(user)
+    async with serialized_writes():
+        await db.commit()
+    invalidate_user(user.username)
+    return user
+
+@app.put("/users/{user_id}/deactivate", response_model=schemas.User)
+async def deactivate_user(
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to deactivate users"
+        )
+    
+    user = await db.get(models.User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    user.is_active = False
+    async with serialized_writes():
+        await db.commit()
+    invalidate_user(user.username)
     return user
 
+@app.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def readiness():
+    # 503 until the database is prepared, so the platform holds traffic back
+    startup_gate.start()
+    status_code = status.HTTP_200_OK if startup_gate.ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(status_code=status_code, content=startup_gate.status())
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    # Per worker process; scrape every worker or run one to get the full picture
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/hashing")
+async def get_hashing_metrics():
+    return hashing_pool.metrics()
+
+@app.get("/metrics/auth-cache")
+async def get_auth_cache_metrics():
+    return cache_stats()
+
+@app.get("/metrics/response-cache")
+async def get_response_cache_metrics():
+    return {"papers": paper_cache.stats()}
+
 @app.get("/users/me", response_model=schemas.User)
 async def get_current_user_info(current_user: schemas.User = Depends(get_current_active_user)):
     return current_user
@@ -433,30 +1026,145 @@ async def get_current_user_info(current_user: schemas.User = Depends(get_current
 @app.get("/users/{username}", response_model=schemas.User)
 async def get_user_by_username(
     username: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
-    user = db.query(models.User).filter(models.User.username == username).first()
+    user = await db.scalar(select(models.User).where(models.User.username == username))
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @app.get("/papers/submissions/user", response_model=List[schemas.PaperSubmission])
 async def get_user_submissions(
+    response: Response,
+    limit: int = Query(SUBMISSIONS_PAGE_SIZE, ge=1, le=SUBMISSIONS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    paper_id: Optional[int] = None,
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    current_user: schemas.User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # Keyset pagination on (submitted_at, id); since is inclusive, until exclusive
+    filters = {"cursor": cursor, "since": since, "until": until, "paper_id": paper_id, "descending": order == "desc"}
+    try:
+        if FAST_JSON:
+            rows = await fetch_submission_rows(db, current_user.id, limit, **filters)
+            last = (rows[limit - 1]["submitted_at"], rows[limit - 1]["id"]) if len(rows) > limit else None
+        else:
+            rows = (await db.scalars(
+                submission_page(select(models.PaperSubmission), current_user.id, limit, **filters)
+            )).all()
+            last = (rows[limit - 1].submitted_at, rows[limit - 1].id) if len(rows) > limit else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    headers = {SUBMISSIONS_CURSOR_HEADER: encode_cursor(*last)} if last else {}
+    if FAST_JSON:
+        with timed("serialize"):
+            return RawJSONResponse(dumps(rows[:limit]), headers=headers)
+    response.headers.update(headers)
+    return rows[:limit]
+
+@app.get("/papers/submissions/user/summary", response_model=List[schemas.SubmissionBucket])
+async def get_user_submission_summary(
+    bucket: str = Query("day", pattern="^(day|week)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    paper_id: Optional[int] = None,
+    current_user: schemas.User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # Downsampled history for charts: one row per day or week instead of every attempt
+    return await submission_buckets(db, current_user.id, bucket, since, until, paper_id)
+
+@app.get("/admin/exports/submissions")
+async def export_submissions(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    paper_id: Optional[int] = None,
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to export submissions"
+        )
+    
+    # Streamed from a server-side cursor; the body opens its own session
+    return export_response(submissions_export_query(since, until, paper_id), format, gzip, "submissions")
+
+@app.get("/admin/exports/papers")
+async def export_papers(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to export papers"
+        )
+    
+    return export_response(papers_export_query(), format, gzip, "papers")
+
+async def get_paper_scores(db, paper_id: int):
+    if await db.get(models.Paper, paper_id) is None:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    return await score_index.get(db, paper_id)
+
+@app.get("/papers/{paper_id}/scores/rank", response_model=schemas.ScoreRank)
+async def get_score_rank(
+    paper_id: int,
+    marks: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    # Defaults to the user's latest marks at the paper
+    distribution = await get_paper_scores(db, paper_id)
+    if marks is None:
+        stats = await db.get(models.UserPaperStats, (current_user.id, paper_id))
+        if stats is None or stats.last_marks is None:
+            raise HTTPException(status_code=404, detail="No marked attempt at this paper")
+        marks = stats.last_marks
+    return {"paper_id": paper_id, **distribution.rank(marks)}
+
+@app.get("/papers/{paper_id}/scores/distribution", response_model=schemas.ScoreDistribution)
+async def get_score_distribution(
+    paper_id: int,
+    width: int = Query(1, ge=1),
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    # Histogram buckets are `width` marks wide
+    distribution = await get_paper_scores(db, paper_id)
+    return {"paper_id": paper_id, **distribution.summary(width)}
+
+@app.get("/papers/{paper_id}/scores/top", response_model=schemas.TopScores)
+async def get_top_scores(
+    paper_id: int,
+    limit: int = Query(10, ge=1, le=SCORE_TOP_MAX),
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    distribution = await get_paper_scores(db, paper_id)
+    return {"paper_id": paper_id, "scores": distribution.top(limit)}
+
+@app.get("/papers/submissions/stats", response_model=schemas.UserProgress)
+async def get_user_submission_stats(
     current_user: schemas.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    submissions = db.query(models.PaperSubmission)\
-        .filter(models.PaperSubmission.user_id == current_user.id)\
-        .order_by(models.PaperSubmission.submitted_at)\
-        .all()
-    return submissions
+    return await get_user_progress(db, current_user.id)
 
 
 @app.delete("/papers/{paper_id}")
 async def delete_paper(
     paper_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     if not current_user.is_admin:
@@ -465,19 +1173,22 @@ async def delete_paper(
             detail="Not authorized to delete papers"
         )
     
-    paper = db.query(models.Paper).filter(models.Paper.id == paper_id).first()
+    paper = await db.get(models.Paper, paper_id)
     if not paper:
         raise HTTPException(status_code=404, detail="Paper not found")
     
-    # Delete associated PDF file if it exists
-    if paper.pdf_path:
-        pdf_path = Path(paper.pdf_path)
-        if pdf_path.exists():
-            pdf_path.unlink()
+    pdf_path = paper.pdf_path
     
     # Delete paper from database
-    db.delete(paper)
-    db.commit()
+    async with serialized_writes():
+        await db.delete(paper)
+        await remove_paper(db, paper_id)
+        # Delete associated PDF file unless another paper still uses it
+        if pdf_path:
+            enqueue(db, "release_blob", paper_id, pdf_path)
+        await db.commit()
+    paper_cache.invalidate()
+    job_queue.notify()
     
     return {"message": "Paper deleted successfully"}
 
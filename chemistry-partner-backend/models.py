@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Text
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
 from sqlalchemy.sql import func
@@ -24,7 +24,7 @@ class Paper(Base):
     description = Column(Text)
     duration_minutes = Column(Integer)
     total_marks = Column(Integer)
-    pdf_path = Column(String, nullable=True)  # Path to stored PDF file
+    pdf_path = Column(String, nullable=True, index=True)  # Path to stored PDF file (blob reference counts)
     
     submissions = relationship("Submission", back_populates="paper")
     questions = relationship("Question", back_populates="paper")
@@ -33,7 +33,7 @@ class Question(Base):
     __tablename__ = "questions"
     
     id = Column(Integer, primary_key=True, index=True)
-    paper_id = Column(Integer, ForeignKey("papers.id"))
+    paper_id = Column(Integer, ForeignKey("papers.id"), index=True)
     question_text = Column(Text)
     answer = Column(String)
     marks = Column(Integer)
@@ -60,4 +60,115 @@ class PaperSubmission(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     time_spent = Column(Integer)  # Time spent in seconds
     marks = Column(Integer)
-    submitted_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    submitted_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # get_user_submissions: WHERE user_id = ? ORDER BY submitted_at
+        Index("ix_paper_submissions_user_submitted", "user_id", "submitted_at"),
+        # Per-paper scans (score distributions, re-grading, exports)
+        Index("ix_paper_submissions_paper_submitted", "paper_id", "submitted_at"),
+        # History pages filtered to one paper: WHERE user_id = ? AND paper_id = ? ORDER BY submitted_at, id
+        Index("ix_paper_submissions_user_paper_submitted", "user_id", "paper_id", "submitted_at"),
+        # Score index catch-up: WHERE paper_id = ? AND id > ?
+        Index("ix_paper_submissions_paper_id", "paper_id", "id"),
+    )
+
+class UserPaperStats(Base):
+    # Running per-user, per-paper aggregates of paper_submissions, kept up to
+    # date by submit_paper so dashboards never scan the full history
+    __tablename__ = "user_paper_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    paper_id = Column(Integer, ForeignKey("papers.id"), primary_key=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    best_marks = Column(Integer)
+    marks_sum = Column(Integer, nullable=False, default=0)
+    total_time_spent = Column(Integer, nullable=False, default=0)  # Seconds
+    last_marks = Column(Integer)
+    last_submitted_at = Column(DateTime(timezone=True))
+
+class PaperJob(Base):
+    # Background work queued by the paper endpoints and run by jobs.py. The row
+    # is written in the same transaction as the change that needs the work, so
+    # a committed upload always has its job; paper_id has no foreign key so the
+    # history outlives deleted papers.
+    __tablename__ = "paper_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # "process_pdf" or "release_blob"
+    paper_id = Column(Integer, index=True)
+    pdf_path = Column(String)
+    status = Column(String, nullable=False, default="queued")  # queued, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime, nullable=False)
+    locked_at = Column(DateTime)  # Lease start while running
+    worker = Column(String)
+    last_error = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        # Claiming: WHERE status = 'queued' AND run_after <= now ORDER BY id
+        Index("ix_paper_jobs_status_run_after", "status", "run_after"),
+    )
+
+class PdfMetadata(Base):
+    # Facts about one stored blob, filled in by the process_pdf job. Blobs are
+    # content-addressed, so papers sharing a pdf_path share this row.
+    __tablename__ = "pdf_metadata"
+
+    pdf_path = Column(String, primary_key=True)
+    sha256 = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    page_count = Column(Integer)  # None when the PDF could not be parsed
+    title = Column(String)
+    author = Column(String)
+    producer = Column(String)
+    processed_at = Column(DateTime, nullable=False)
+
+class SubmissionAnswers(Base):
+    # What was answered in a server-graded attempt, kept so the attempt can
+    # be re-marked after an answer-key fix (grading.regrade_paper)
+    __tablename__ = "submission_answers"
+
+    submission_id = Column(Integer, ForeignKey("paper_submissions.id"), primary_key=True)
+    paper_id = Column(Integer, ForeignKey("papers.id"), nullable=False)
+    answers = Column(Text, nullable=False)  # JSON object: question id -> answer
+    key_version = Column(String, nullable=False)  # AnswerKey.version the marks came from
+
+    __table_args__ = (
+        # Re-grading walks one paper's attempts in submission order
+        Index("ix_submission_answers_paper_submission", "paper_id", "submission_id"),
+    )
+
+class ExamAttempt(Base):
+    # A timed sitting of a paper. Answers are autosaved here through
+    # attempts.AutosaveBuffer until the attempt is submitted.
+    __tablename__ = "exam_attempts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    paper_id = Column(Integer, ForeignKey("papers.id"), nullable=False)
+    status = Column(String, nullable=False, default="in_progress")  # in_progress, submitted
+    started_at = Column(DateTime, nullable=False)
+    deadline = Column(DateTime)  # None for papers without a duration
+    answers = Column(Text, nullable=False, default="{}")  # JSON object: question id -> answer
+    revision = Column(Integer, nullable=False, default=0)  # Client revision of the saved answers
+    last_seen_at = Column(DateTime)  # Latest heartbeat or autosave
+    submission_id = Column(Integer, ForeignKey("paper_submissions.id"))
+
+    __table_args__ = (
+        # Resuming: WHERE user_id = ? AND paper_id = ? AND status = 'in_progress'
+        Index("ix_exam_attempts_user_paper_status", "user_id", "paper_id", "status"),
+    )
+
+class ScoreSnapshot(Base):
+    # Persisted scores.ScoreIndex state for one paper, so a restarted worker
+    # only counts the attempts made since the snapshot
+    __tablename__ = "score_snapshots"
+
+    paper_id = Column(Integer, primary_key=True)
+    counts = Column(Text, nullable=False)  # JSON object: marks -> attempts
+    last_submission_id = Column(Integer, nullable=False)  # Attempts up to this id are counted
+    epoch = Column(Integer, nullable=False, default=0)  # Bumped when marks change underneath (re-grading)
+    taken_at = Column(DateTime, nullable=False)
@@ -0,0 +1,120 @@
+import base64
+import hashlib
+import hmac
+import math
+import os
+import time
+from pathlib import Path
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from auth_cache import TTLCache
+from response_cache import paper_cache
+from shared_state import invalidation_bus
+from storage import UPLOAD_DIR, content_etag, resolve_pdf_path
+import models
+
+# Signed download links stay valid this long; expiry is rounded up to the
+# minute so a paper reopened within it gets the same, browser-cached URL
+PDF_LINK_TTL = int(os.getenv("PDF_LINK_TTL", "300"))
+# Shared by every worker; defaults to a key derived from the JWT secret
+PDF_LINK_SECRET = os.getenv("PDF_LINK_SECRET")
+# nginx `internal` location aliased to UPLOAD_DIR, e.g. /protected-pdfs/;
+# when set, full downloads are answered with X-Accel-Redirect and sent by nginx
+PDF_ACCEL_REDIRECT_PREFIX = os.getenv("PDF_ACCEL_REDIRECT_PREFIX")
+PDF_LOCATION_CACHE_SIZE = int(os.getenv("PDF_LOCATION_CACHE_SIZE", "10000"))
+PDF_LOCATION_CACHE_TTL = 300
+
+
+class PdfLinkSigner:
+    """HMAC-SHA256 signatures binding a paper, a user and an expiry time."""
+
+    def __init__(self, secret: str, ttl: int = PDF_LINK_TTL):
+        # A key of its own, so a link signature can never pass as anything else
+        self._key = hmac.new(secret.encode(), b"pdf-link", hashlib.sha256).digest()
+        self.ttl = ttl
+
+    def sign(self, paper_id: int, user_id: int, expires: int) -> str:
+        mac = hmac.new(self._key, f"{paper_id}:{user_id}:{expires}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(mac).decode().rstrip("=")
+
+    def issue(self, paper_id: int, user_id: int, now: float = None):
+        """(expires, signature) for a new link."""
+        expires = math.ceil(((now or time.time()) + self.ttl) / 60) * 60
+        return expires, self.sign(paper_id, user_id, expires)
+
+    def verify(self, paper_id: int, user_id: int, expires: int, signature: str, now: float = None) -> bool:
+        if expires < (now or time.time()):
+            return False
+        return hmac.compare_digest(self.sign(paper_id, user_id, expires), signature)
+
+
+class PdfNotFound(LookupError):
+    """No paper, no PDF on the paper, or no file behind it; the message says which."""
+
+
+class PdfLocation:
+    __slots__ = ("path", "stat", "etag", "accel_uri")
+
+    def __init__(self, path: Path, stat, accel_uri: str = None):
+        self.path = path
+        self.stat = stat
+        self.etag = content_etag(path)
+        self.accel_uri = accel_uri
+
+def _accel_uri(path: Path):
+    if not PDF_ACCEL_REDIRECT_PREFIX:
+        return None
+    try:
+        relative = path.resolve().relative_to(UPLOAD_DIR.resolve())
+    except ValueError:
+        return None  # Outside the aliased directory; served by the app
+    return PDF_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative.as_posix()
+
+
+class PdfLocationCache:
+    """paper_id -> PdfLocation (path, stat, ETag) of its PDF.
+
+    Entries carry the paper_cache version they were read at, so the
+    invalidation every paper write already does retires them in all workers.
+    Blobs never change in place, which makes the cached stat safe to reuse.
+    """
+
+    def __init__(self, maxsize: int = PDF_LOCATION_CACHE_SIZE, ttl: int = PDF_LOCATION_CACHE_TTL):
+        self._entries = TTLCache(maxsize, ttl=ttl)
+
+    async def get(self, db, paper_id: int) -> PdfLocation:
+        invalidation_bus.poll()
+        entry = self._entries.get(paper_id)
+        if entry is not None and entry[0] == paper_cache.version:
+            return entry[1]
+        version = paper_cache.version
+        location = await self._load(db, paper_id)
+        if version == paper_cache.version:
+            self._entries.set(paper_id, (version, location))
+        return location
+
+    def peek(self, paper_id: int):
+        """The cached location if it is still current, without touching the database."""
+        invalidation_bus.poll()
+        entry = self._entries.peek(paper_id)
+        if entry is not None and entry[0] == paper_cache.version:
+            return entry[1]
+        return None
+
+    async def _load(self, db, paper_id: int) -> PdfLocation:
+        row = (await db.execute(select(models.Paper.pdf_path).where(models.Paper.id == paper_id))).first()
+        if row is None:
+            raise PdfNotFound("Paper not found")
+        if not row.pdf_path:
+            raise PdfNotFound("PDF not found for this paper")
+        path = resolve_pdf_path(row.pdf_path)
+        try:
+            stat = await run_in_threadpool(os.stat, path)
+        except FileNotFoundError:
+            raise PdfNotFound("PDF file not found on server")
+        return PdfLocation(path, stat, _accel_uri(path))
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+pdf_locations = PdfLocationCache()
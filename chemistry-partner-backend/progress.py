@@ -0,0 +1,159 @@
+from sqlalchemy import case, delete, func, insert, select
+from database import DB_DIALECT
+import models
+import schemas
+
+
+def _stats_upsert():
+    stats = models.UserPaperStats.__table__
+    # Both dialects spell the upsert as INSERT ... ON CONFLICT DO UPDATE; only
+    # the one in use is imported (the postgresql dialect is slow to load)
+    if DB_DIALECT == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(stats)
+    new = stmt.excluded
+    # Offline syncs can deliver attempts out of order, so "last" follows submitted_at
+    is_newer = (stats.c.last_submitted_at.is_(None)) | (new.last_submitted_at >= stats.c.last_submitted_at)
+    return stmt.on_conflict_do_update(
+        index_elements=[stats.c.user_id, stats.c.paper_id],
+        set_={
+            "attempts": stats.c.attempts + new.attempts,
+            "best_marks": case(
+                (stats.c.best_marks.is_(None), new.best_marks),
+                (new.best_marks > stats.c.best_marks, new.best_marks),
+                else_=stats.c.best_marks,
+            ),
+            "marks_sum": stats.c.marks_sum + new.marks_sum,
+            "total_time_spent": stats.c.total_time_spent + new.total_time_spent,
+            "last_marks": case((is_newer, new.last_marks), else_=stats.c.last_marks),
+            "last_submitted_at": case((is_newer, new.last_submitted_at), else_=stats.c.last_submitted_at),
+        },
+    )
+
+def _stats_values(submissions) -> list:
+    # Pre-aggregate per (user, paper) so a batch needs one upsert row per pair
+    grouped = {}
+    for sub in submissions:
+        key = (sub["user_id"], sub["paper_id"])
+        marks = sub["marks"]
+        row = grouped.get(key)
+        if row is None:
+            grouped[key] = {
+                "user_id": sub["user_id"],
+                "paper_id": sub["paper_id"],
+                "attempts": 1,
+                "best_marks": marks,
+                "marks_sum": marks or 0,
+                "total_time_spent": sub["time_spent"] or 0,
+                "last_marks": marks,
+                "last_submitted_at": sub["submitted_at"],
+            }
+            continue
+        row["attempts"] += 1
+        if marks is not None and (row["best_marks"] is None or marks > row["best_marks"]):
+            row["best_marks"] = marks
+        row["marks_sum"] += marks or 0
+        row["total_time_spent"] += sub["time_spent"] or 0
+        if sub["submitted_at"] >= row["last_submitted_at"]:
+            row["last_marks"] = marks
+            row["last_submitted_at"] = sub["submitted_at"]
+    return list(grouped.values())
+
+async def record_submissions(db, submissions):
+    """Fold submission rows (mappings) into user_paper_stats. Runs in the caller's transaction."""
+    values = _stats_values(submissions)
+    if values:
+        await db.execute(_stats_upsert(), values)
+
+async def record_submission(db, submission):
+    await record_submissions(db, [{
+        "user_id": submission.user_id,
+        "paper_id": submission.paper_id,
+        "marks": submission.marks,
+        "time_spent": submission.time_spent,
+        "submitted_at": submission.submitted_at,
+    }])
+
+
+async def get_user_progress(db, user_id: int) -> schemas.UserProgress:
+    rows = (await db.scalars(
+        select(models.UserPaperStats)
+        .where(models.UserPaperStats.user_id == user_id)
+        .order_by(models.UserPaperStats.paper_id)
+    )).all()
+
+    papers = [
+        schemas.PaperProgress(
+            paper_id=row.paper_id,
+            attempts=row.attempts,
+            best_marks=row.best_marks,
+            average_marks=row.marks_sum / row.attempts if row.attempts else 0.0,
+            last_marks=row.last_marks,
+            total_time_spent=row.total_time_spent,
+            last_submitted_at=row.last_submitted_at,
+        )
+        for row in rows
+    ]
+    total_attempts = sum(row.attempts for row in rows)
+    best = [row.best_marks for row in rows if row.best_marks is not None]
+    last = [row.last_submitted_at for row in rows if row.last_submitted_at is not None]
+    return schemas.UserProgress(
+        total_attempts=total_attempts,
+        papers_attempted=len(rows),
+        average_marks=sum(row.marks_sum for row in rows) / total_attempts if total_attempts else 0.0,
+        best_marks=max(best) if best else None,
+        total_time_spent=sum(row.total_time_spent for row in rows),
+        last_submitted_at=max(last) if last else None,
+        papers=papers,
+    )
+
+
+def _stats_from_submissions(paper_id: int = None):
+    """INSERT ... SELECT aggregating paper_submissions into user_paper_stats."""
+    stats = models.UserPaperStats.__table__
+    subs = models.PaperSubmission.__table__
+    latest = subs.alias("latest")
+    last_marks = (
+        select(latest.c.marks)
+        .where(latest.c.user_id == subs.c.user_id, latest.c.paper_id == subs.c.paper_id)
+        .order_by(latest.c.submitted_at.desc(), latest.c.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    aggregate = (
+        select(
+            subs.c.user_id,
+            subs.c.paper_id,
+            func.count(),
+            func.max(subs.c.marks),
+            func.coalesce(func.sum(subs.c.marks), 0),
+            func.coalesce(func.sum(subs.c.time_spent), 0),
+            last_marks,
+            func.max(subs.c.submitted_at),
+        )
+        .where(subs.c.user_id.isnot(None), subs.c.paper_id.isnot(None))
+        .group_by(subs.c.user_id, subs.c.paper_id)
+    )
+    if paper_id is not None:
+        aggregate = aggregate.where(subs.c.paper_id == paper_id)
+    return insert(stats).from_select(
+        ["user_id", "paper_id", "attempts", "best_marks", "marks_sum",
+         "total_time_spent", "last_marks", "last_submitted_at"],
+        aggregate,
+    )
+
+def backfill_progress_stats(engine):
+    """Build user_paper_stats from paper_submissions the first time the table exists."""
+    stats = models.UserPaperStats.__table__
+    with engine.begin() as conn:
+        if conn.execute(select(func.count()).select_from(stats)).scalar():
+            return
+        conn.execute(_stats_from_submissions())
+
+async def rebuild_paper_stats(db, paper_id: int):
+    """Recompute one paper's aggregates after its marks changed (re-grading). Caller commits."""
+    stats = models.UserPaperStats.__table__
+    await db.execute(delete(stats).where(stats.c.paper_id == paper_id))
+    await db.execute(_stats_from_submissions(paper_id))
@@ -0,0 +1,139 @@
+import csv
+import json
+import os
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import insert
+from starlette.concurrency import run_in_threadpool
+from database import serialized_writes
+import models
+import schemas
+
+# Rows validated per worker-thread hop and inserted per transaction; memory
+# use is bounded by this, not by the size of the upload
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# Rejected rows listed in the report; later ones are only counted
+IMPORT_MAX_ERRORS = 1000
+IMPORT_FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+REQUIRED_COLUMNS = ("question_text", "answer", "marks")
+
+row_adapter = TypeAdapter(schemas.QuestionImportRow)
+
+
+class ImportFormatError(ValueError):
+    """The upload can't be read at all (unknown format, missing CSV columns)."""
+
+
+def detect_format(filename: str, requested: str = None) -> str:
+    if requested:
+        return requested
+    for suffix, fmt in IMPORT_FORMATS.items():
+        if (filename or "").lower().endswith(suffix):
+            return fmt
+    raise ImportFormatError("Upload a .csv or .ndjson file, or pass format=csv|ndjson")
+
+def _iter_csv(lines):
+    reader = csv.DictReader(lines)
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+    if missing:
+        raise ImportFormatError(f"CSV header is missing: {', '.join(missing)}")
+    for record in reader:
+        # line_num is the physical line the record ended on, quoted newlines included
+        yield reader.line_num, record, None
+
+def _iter_ndjson(lines):
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "Expected a JSON object"
+            continue
+        yield line_number, record, None
+
+class _UnreadableLine(Exception):
+    def __init__(self, line_number: int, reason: str):
+        self.line_number = line_number
+        self.reason = reason
+
+def _decoded_lines(binary_file):
+    # Decoded one line at a time so a bad byte is reported on its own line
+    # and the rows before it still count
+    for line_number, raw in enumerate(binary_file, start=1):
+        try:
+            line = raw.decode("utf-8-sig" if line_number == 1 else "utf-8")
+        except UnicodeDecodeError as e:
+            raise _UnreadableLine(line_number, f"not valid UTF-8 ({e.reason})")
+        yield line
+
+def iter_records(binary_file, fmt: str):
+    """Yield (line, record, error) for every row of a binary upload, reading it lazily."""
+    lines = _decoded_lines(binary_file)
+    records = _iter_csv(lines) if fmt == "csv" else _iter_ndjson(lines)
+    try:
+        yield from records
+    except _UnreadableLine as e:
+        # The rest of the file can't be split into rows reliably, so stop here
+        yield e.line_number, None, f"Line is {e.reason}; import stopped"
+    except csv.Error as e:
+        yield None, None, f"Malformed CSV, import stopped: {e}"
+
+def _error_detail(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, err['loc'])) or 'row'}: {err['msg']}" for err in error.errors())
+
+def read_batch(records, paper_id: int, size: int = IMPORT_BATCH_SIZE):
+    """Parse and validate up to `size` rows; runs in a worker thread."""
+    rows = []
+    errors = []
+    exhausted = True
+    for line_number, record, error in records:
+        if error is None:
+            try:
+                row = row_adapter.validate_python(record)
+            except ValidationError as e:
+                error = _error_detail(e)
+            else:
+                rows.append({"paper_id": paper_id, "question_text": row.question_text,
+                             "answer": row.answer, "marks": row.marks})
+        if error is not None:
+            errors.append({"line": line_number, "detail": error})
+        if len(rows) + len(errors) >= size:
+            exhausted = False
+            break
+    return rows, errors, exhausted
+
+
+async def import_questions(db, paper_id: int, binary_file, fmt: str, dry_run: bool = False) -> dict:
+    """Stream questions from a CSV/NDJSON file into a paper, committing every batch.
+
+    Good rows are kept even when others are rejected; the report lists the
+    first IMPORT_MAX_ERRORS rejected lines with the reason. The import is not
+    atomic: if it fails part way, the batches committed before the failure
+    stay. Committing per batch keeps the database write lock to one batch's
+    INSERT rather than the parse of the whole upload.
+    """
+    records = iter_records(binary_file, fmt)
+    imported = 0
+    rejected = 0
+    errors = []
+    exhausted = False
+    while not exhausted:
+        rows, batch_errors, exhausted = await run_in_threadpool(read_batch, records, paper_id)
+        rejected += len(batch_errors)
+        errors.extend(batch_errors[:IMPORT_MAX_ERRORS - len(errors)])
+        if rows and not dry_run:
+            async with serialized_writes():
+                await db.execute(insert(models.Question), rows)
+                await db.commit()
+        imported += len(rows)
+    return {
+        "paper_id": paper_id,
+        "imported": imported,
+        "rejected": rejected,
+        "dry_run": dry_run,
+        "errors": errors,
+        "errors_truncated": rejected > len(errors),
+    }
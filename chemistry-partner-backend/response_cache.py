@@ -0,0 +1,66 @@
+import hashlib
+import os
+from fastapi import Request, Response
+from auth_cache import TTLCache
+from http_cache import is_not_modified, not_modified_response
+from shared_state import invalidation_bus
+
+# Serialised responses kept per worker; only distinct page/paper keys count
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+# Authenticated data: browsers may store it but must revalidate every time
+RESPONSE_CACHE_CONTROL = "private, no-cache"
+
+
+class CachedResponse:
+    """Ready-to-send JSON body with its strong ETag and extra headers."""
+
+    def __init__(self, body: bytes, headers: dict = None):
+        self.body = body
+        self.etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        self.headers = {"ETag": self.etag, "Cache-Control": RESPONSE_CACHE_CONTROL, **(headers or {})}
+
+    def to_response(self, request: Request) -> Response:
+        if is_not_modified(request, self.etag):
+            return not_modified_response(self.headers)
+        return Response(content=self.body, media_type="application/json", headers=self.headers)
+
+
+class ResponseCache:
+    """Serialised responses for one resource family, dropped as a whole on every write.
+
+    Writers call invalidate() after committing, which bumps the version and
+    tells the other workers through the invalidation bus. A reader records
+    the version before querying and its result is only stored if no write
+    happened meanwhile, so a slow read can't re-insert stale bytes. ETags
+    hash the body, so they agree between workers and across restarts.
+    """
+
+    def __init__(self, namespace: str, maxsize: int = RESPONSE_CACHE_SIZE):
+        self.namespace = namespace
+        self.version = 0
+        self._entries = TTLCache(maxsize)
+        invalidation_bus.subscribe(namespace, self._drop)
+
+    def get(self, key):
+        invalidation_bus.poll()
+        return self._entries.get(key)
+
+    def set(self, key, version: int, entry: CachedResponse) -> CachedResponse:
+        if version == self.version:
+            self._entries.set(key, entry)
+        return entry
+
+    def _drop(self, _key=None):
+        self.version += 1
+        self._entries.clear()
+
+    def invalidate(self):
+        self._drop()
+        invalidation_bus.publish(self.namespace, "*")
+
+    def stats(self) -> dict:
+        return {"version": self.version, **self._entries.stats()}
+
+
+# GET /papers/ pages and GET /papers/{id}
+paper_cache = ResponseCache("papers")
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional, List
-from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import Dict, Optional, List
+from datetime import date, datetime
 
 class UserBase(BaseModel):
     email: str  # Changed from EmailStr to str
@@ -32,6 +32,29 @@ class QuestionBase(BaseModel):
 class QuestionCreate(QuestionBase):
     pass
 
+class QuestionUpdate(BaseModel):
+    question_text: Optional[str] = None
+    answer: Optional[str] = None  # Alternatives separated by "|"; numbers may carry "± tolerance"
+    marks: Optional[int] = Field(None, ge=0)
+
+class QuestionImportRow(QuestionCreate):
+    # Stricter than QuestionCreate: imported rows are checked before insert
+    question_text: str = Field(..., min_length=1)
+    answer: str = Field(..., min_length=1)
+    marks: int = Field(..., ge=0)
+
+class QuestionImportError(BaseModel):
+    line: Optional[int] = None  # Line in the uploaded file (the header is line 1 for CSV)
+    detail: str
+
+class QuestionImportResult(BaseModel):
+    paper_id: int
+    imported: int
+    rejected: int
+    dry_run: bool
+    errors: List[QuestionImportError] = []
+    errors_truncated: bool  # More rows were rejected than are listed
+
 class Question(QuestionBase):
     id: int
     paper_id: int
@@ -39,6 +62,16 @@ class Question(QuestionBase):
     class Config:
         from_attributes = True  # Changed from orm_mode = True
 
+class StudentQuestion(BaseModel):
+    # What students see of a question: everything but the answer
+    question_text: str
+    marks: int
+    id: int
+    paper_id: int
+
+    class Config:
+        from_attributes = True
+
 class PaperBase(BaseModel):
     title: str
     description: str
@@ -56,14 +89,25 @@ class PaperUpdate(BaseModel):
     duration_minutes: Optional[int] = None
     total_marks: Optional[int] = None
 
-class Paper(PaperBase):
+class PaperSummary(PaperBase):
     id: int
     pdf_path: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class Paper(PaperSummary):
     questions: List[Question] = []
 
     class Config:
         from_attributes = True  # Changed from orm_mode = True
 
+class StudentPaper(PaperSummary):
+    questions: List[StudentQuestion] = []
+
+    class Config:
+        from_attributes = True
+
 class SubmissionBase(BaseModel):
     paper_id: int
     score: int
@@ -79,18 +123,67 @@ class Submission(SubmissionBase):
     class Config:
         from_attributes = True  # Changed from orm_mode = True
 
+class PaperSearchResult(BaseModel):
+    id: int
+    title: str
+    snippet: str  # Best matching fragment, hits wrapped in [ ]
+    score: float  # Higher is a better match
+
+class PdfMetadata(BaseModel):
+    sha256: str
+    size: int
+    page_count: Optional[int] = None  # None when the PDF could not be parsed
+    title: Optional[str] = None
+    author: Optional[str] = None
+    producer: Optional[str] = None
+    processed_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class PaperJob(BaseModel):
+    id: int
+    kind: str  # "process_pdf" or "release_blob"
+    status: str  # queued, running, done or failed
+    pdf_path: Optional[str] = None
+    attempts: int
+    run_after: datetime
+    last_error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class PaperProcessingStatus(BaseModel):
+    paper_id: int
+    pdf_path: Optional[str] = None
+    pdf: Optional[PdfMetadata] = None  # Filled in by the process_pdf job
+    jobs: List[PaperJob] = []  # Most recent first
+
 class PaperUploadResponse(BaseModel):
     paper_id: int
     title: str
     pdf_path: str
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    deduplicated: Optional[bool] = None
 
 
+class PdfLink(BaseModel):
+    url: str  # Works without an Authorization header until expires_at
+    expires_at: datetime
+
 class PaperSubmissionBase(BaseModel):
     time_spent: int
     marks: int
 
 class PaperSubmissionCreate(PaperSubmissionBase):
-    pass
+    # Papers with questions are marked on the server from `answers` (question
+    # id -> answer) and any client `marks` are ignored; `marks` is only used
+    # for papers without an answer key
+    marks: Optional[int] = None
+    answers: Optional[Dict[int, str]] = None
 
 class PaperSubmission(PaperSubmissionBase):
     id: int
@@ -99,4 +192,115 @@ class PaperSubmission(PaperSubmissionBase):
     submitted_at: datetime
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+MAX_SUBMISSION_BATCH = 1000
+
+class PaperSubmissionBatchItem(PaperSubmissionCreate):
+    paper_id: int
+    submitted_at: Optional[datetime] = None  # When the attempt was made offline
+
+class PaperSubmissionBatch(BaseModel):
+    submissions: List[PaperSubmissionBatchItem] = Field(..., min_length=1, max_length=MAX_SUBMISSION_BATCH)
+
+class PaperSubmissionBatchItemResult(BaseModel):
+    index: int
+    paper_id: int
+    status: str  # "created" or "rejected"
+    id: Optional[int] = None
+    marks: Optional[int] = None  # As recorded, i.e. as graded by the server when the paper has questions
+    detail: Optional[str] = None
+
+class PaperSubmissionBatchResult(BaseModel):
+    created: int
+    rejected: int
+    results: List[PaperSubmissionBatchItemResult]
+
+class RegradeResult(BaseModel):
+    paper_id: int
+    key_version: str
+    graded: int  # Attempts with stored answers
+    changed: int  # Of those, attempts whose marks changed
+
+class SubmissionBucket(BaseModel):
+    start: date  # First UTC day of the bucket; weeks start on Monday
+    attempts: int
+    average_marks: float
+    best_marks: Optional[int] = None
+    total_time_spent: int
+
+class ExamAttempt(BaseModel):
+    id: int
+    paper_id: int
+    user_id: int
+    status: str  # "in_progress", "expired" (time is up, not submitted yet) or "submitted"
+    started_at: datetime
+    deadline: Optional[datetime] = None  # None for papers without a duration
+    remaining_seconds: Optional[int] = None
+    revision: int  # Of the saved answers; the next autosave must send a higher one
+    answers: Dict[int, str] = {}
+    submission_id: Optional[int] = None
+
+class AttemptAutosave(BaseModel):
+    # The whole answer sheet so far (question id -> answer); revision must
+    # increase with every save so late-arriving saves can be told apart
+    revision: int = Field(..., ge=1)
+    answers: Dict[int, str]
+
+class AttemptStatus(BaseModel):
+    id: int
+    status: str
+    revision: int  # Newest saved revision, higher than the one sent if that save was out of date
+    deadline: Optional[datetime] = None
+    remaining_seconds: Optional[int] = None
+    server_time: datetime
+
+class AttemptSubmit(BaseModel):
+    answers: Optional[Dict[int, str]] = None  # Defaults to the last autosave
+    marks: Optional[int] = None  # Only used for papers without an answer key
+
+class ScoreRank(BaseModel):
+    paper_id: int
+    marks: int
+    attempts: int  # All attempts at the paper
+    below: int  # Attempts with fewer marks
+    equal: int
+    percentile_rank: Optional[float] = None  # 0-100, tied attempts count half; None without attempts
+
+class ScoreBucket(BaseModel):
+    marks: int  # Lowest marks in the bucket
+    count: int
+
+class ScoreDistribution(BaseModel):
+    paper_id: int
+    attempts: int
+    mean: Optional[float] = None
+    min: Optional[int] = None
+    max: Optional[int] = None
+    p25: Optional[int] = None
+    median: Optional[int] = None
+    p75: Optional[int] = None
+    p90: Optional[int] = None
+    buckets: List[ScoreBucket] = []
+
+class TopScores(BaseModel):
+    paper_id: int
+    scores: List[int]  # Highest marks first
+
+class PaperProgress(BaseModel):
+    paper_id: int
+    attempts: int
+    best_marks: Optional[int] = None
+    average_marks: float
+    last_marks: Optional[int] = None
+    total_time_spent: int
+    last_submitted_at: Optional[datetime] = None
+
+class UserProgress(BaseModel):
+    total_attempts: int
+    papers_attempted: int
+    average_marks: float
+    best_marks: Optional[int] = None
+    total_time_spent: int
+    last_submitted_at: Optional[datetime] = None
+    papers: List[PaperProgress] = []
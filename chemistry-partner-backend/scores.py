@@ -0,0 +1,352 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from bisect import bisect_left
+from datetime import datetime
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from auth_cache import TTLCache
+from database import AsyncSessionLocal, serialized_writes
+from shared_state import invalidation_bus
+import models
+
+logger = logging.getLogger(__name__)
+
+# Papers whose distributions are kept in memory per worker
+SCORE_INDEX_SIZE = int(os.getenv("SCORE_INDEX_SIZE", "1000"))
+# Attempts submitted through other workers show up at most this many seconds late
+SCORE_REFRESH_INTERVAL = float(os.getenv("SCORE_REFRESH_INTERVAL", "5"))
+# Changed distributions are written to score_snapshots this often and on shutdown
+SCORE_SNAPSHOT_INTERVAL = float(os.getenv("SCORE_SNAPSHOT_INTERVAL", "300"))
+SCORE_TOP_MAX = 100
+
+
+class ScoreDistribution:
+    """Attempt counts per mark for one paper.
+
+    The distinct marks are kept sorted, with a Fenwick tree over their
+    counts, so adding an attempt, a percentile rank and a quantile are
+    O(log k) in the k distinct marks. Only a mark never seen before costs
+    O(k), to rebuild the tree.
+    """
+
+    def __init__(self, counts: dict = None):
+        counts = counts or {}
+        self.values = sorted(counts)
+        self.counts = [counts[value] for value in self.values]
+        self.total = sum(self.counts)
+        self.marks_sum = sum(value * count for value, count in counts.items())
+        self._build()
+
+    def _build(self):
+        tree = [0] * (len(self.counts) + 1)
+        for index, count in enumerate(self.counts, start=1):
+            tree[index] += count
+            parent = index + (index & -index)
+            if parent < len(tree):
+                tree[parent] += tree[index]
+        self._tree = tree
+
+    def _prefix(self, index: int) -> int:
+        # Attempts with marks below values[index]
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def _find(self, rank: int) -> int:
+        # Index of the mark held by the attempt at 0-based `rank` in ascending order
+        position = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            following = position + step
+            if following < len(self._tree) and self._tree[following] <= rank:
+                position = following
+                rank -= self._tree[following]
+            step >>= 1
+        return position
+
+    def add(self, marks: int, count: int = 1):
+        index = bisect_left(self.values, marks)
+        self.total += count
+        self.marks_sum += marks * count
+        if index < len(self.values) and self.values[index] == marks:
+            self.counts[index] += count
+            index += 1
+            while index < len(self._tree):
+                self._tree[index] += count
+                index += index & -index
+        else:
+            self.values.insert(index, marks)
+            self.counts.insert(index, count)
+            self._build()
+
+    def rank(self, marks: int) -> dict:
+        """How `marks` compares; the percentile rank counts tied attempts as half below."""
+        index = bisect_left(self.values, marks)
+        below = self._prefix(index)
+        equal = self.counts[index] if index < len(self.values) and self.values[index] == marks else 0
+        return {
+            "marks": marks,
+            "attempts": self.total,
+            "below": below,
+            "equal": equal,
+            "percentile_rank": 100.0 * (below + equal / 2) / self.total if self.total else None,
+        }
+
+    def quantile(self, q: float):
+        """Nearest-rank quantile, e.g. 0.5 for the median; None without attempts."""
+        if not self.total:
+            return None
+        rank = min(self.total - 1, max(0, math.ceil(q * self.total) - 1))
+        return self.values[self._find(rank)]
+
+    def top(self, limit: int) -> list:
+        """The `limit` highest marks, best first."""
+        scores = []
+        for index in range(len(self.values) - 1, -1, -1):
+            scores.extend([self.values[index]] * min(self.counts[index], limit - len(scores)))
+            if len(scores) >= limit:
+                break
+        return scores
+
+    def histogram(self, width: int = 1) -> list:
+        buckets = {}
+        for value, count in zip(self.values, self.counts):
+            start = value // width * width
+            buckets[start] = buckets.get(start, 0) + count
+        return [{"marks": start, "count": count} for start, count in buckets.items()]
+
+    def summary(self, width: int = 1) -> dict:
+        return {
+            "attempts": self.total,
+            "mean": self.marks_sum / self.total if self.total else None,
+            "min": self.values[0] if self.values else None,
+            "max": self.values[-1] if self.values else None,
+            "p25": self.quantile(0.25),
+            "median": self.quantile(0.5),
+            "p75": self.quantile(0.75),
+            "p90": self.quantile(0.9),
+            "buckets": self.histogram(width),
+        }
+
+    def as_counts(self) -> dict:
+        return dict(zip(self.values, self.counts))
+
+
+class _PaperScores:
+    __slots__ = ("distribution", "high_water", "local", "epoch", "refreshed_at", "lock")
+
+    def __init__(self, distribution: ScoreDistribution, high_water: int, epoch: int):
+        self.distribution = distribution
+        self.high_water = high_water  # Every attempt up to this id is counted
+        self.local = {}  # id -> marks of attempts above high_water counted by record()
+        self.epoch = epoch
+        self.refreshed_at = 0.0
+        self.lock = asyncio.Lock()  # One catch-up at a time, or attempts would be counted twice
+
+
+class ScoreIndex:
+    """Per-paper score distributions, loaded lazily and kept up to date in memory.
+
+    A paper is loaded from its snapshot plus the attempts made since, or
+    counted from paper_submissions if it has none. Submits in this worker
+    are added by record(); those made through other workers are folded in by
+    id every SCORE_REFRESH_INTERVAL seconds. That relies on ids growing in
+    commit order, which holds for SQLite's single writer.
+    """
+
+    def __init__(self, maxsize: int = SCORE_INDEX_SIZE, session_factory=AsyncSessionLocal):
+        self._papers = TTLCache(maxsize)
+        self._session_factory = session_factory
+        self._generation = 0
+        self._dirty = set()
+        self._task = None
+        self._stopping = None
+        self.loads = 0
+        self.snapshot_loads = 0
+        self.refreshes = 0
+        self.snapshots_written = 0
+        invalidation_bus.subscribe("scores", self._drop)
+
+    def _drop(self, paper_id):
+        self._generation += 1
+        self._papers.pop(int(paper_id))
+        self._dirty.discard(int(paper_id))
+
+    def invalidate(self, paper_id: int):
+        """Forget a paper in every worker; call after committing reset_scores()."""
+        self._drop(paper_id)
+        invalidation_bus.publish("scores", str(paper_id))
+
+    async def get(self, db, paper_id: int) -> ScoreDistribution:
+        invalidation_bus.poll()
+        scores = self._papers.get(paper_id)
+        if scores is None:
+            generation = self._generation
+            scores = await self._load(db, paper_id)
+            if generation == self._generation:
+                self._papers.set(paper_id, scores)
+        elif time.monotonic() - scores.refreshed_at >= SCORE_REFRESH_INTERVAL:
+            await self._catch_up(db, paper_id, scores)
+        return scores.distribution
+
+    def record(self, paper_id: int, submission_id: int, marks):
+        """Count a committed attempt straight away if its paper is loaded."""
+        scores = self._papers.peek(paper_id)
+        if scores is None or marks is None or submission_id <= scores.high_water:
+            return
+        if submission_id not in scores.local:
+            scores.local[submission_id] = marks
+            scores.distribution.add(marks)
+            self._dirty.add(paper_id)
+
+    async def _load(self, db, paper_id: int) -> _PaperScores:
+        snapshot = await db.get(models.ScoreSnapshot, paper_id)
+        if snapshot is not None:
+            counts = {int(marks): count for marks, count in json.loads(snapshot.counts).items()}
+            scores = _PaperScores(ScoreDistribution(counts), snapshot.last_submission_id, snapshot.epoch)
+            self.snapshot_loads += 1
+        else:
+            scores = _PaperScores(ScoreDistribution(), 0, 0)
+        high_water = scores.high_water
+        await self._catch_up(db, paper_id, scores)
+        if scores.high_water != high_water:
+            self._dirty.add(paper_id)
+        self.loads += 1
+        return scores
+
+    async def _catch_up(self, db, paper_id: int, scores: _PaperScores):
+        # Stamped first so concurrent readers serve what is there instead of waiting
+        scores.refreshed_at = time.monotonic()
+        async with scores.lock:
+            await self._fold_new_attempts(db, paper_id, scores)
+
+    async def _fold_new_attempts(self, db, paper_id: int, scores: _PaperScores):
+        submissions = models.PaperSubmission
+        rows = (await db.execute(
+            select(submissions.marks, func.count(), func.max(submissions.id))
+            .where(submissions.paper_id == paper_id,
+                   submissions.id > scores.high_water,
+                   submissions.marks.isnot(None))
+            .group_by(submissions.marks)
+        )).all()
+        if not rows:
+            return
+        self.refreshes += 1
+        seen = max(last_id for _, _, last_id in rows)
+        counts = {marks: count for marks, count, _ in rows}
+        # Attempts record() already counted were in the result too
+        for submission_id, marks in list(scores.local.items()):
+            if submission_id <= seen and marks in counts:
+                counts[marks] -= 1
+                del scores.local[submission_id]
+        for marks, count in counts.items():
+            if count:
+                scores.distribution.add(marks, count)
+        scores.high_water = max(scores.high_water, seen)
+
+    async def snapshot(self) -> int:
+        """Write every changed distribution to score_snapshots; returns how many were written."""
+        dirty, self._dirty = self._dirty, set()
+        written = 0
+        async with self._session_factory() as db:
+            for paper_id in dirty:
+                invalidation_bus.poll()
+                scores = self._papers.get(paper_id)
+                if scores is None:
+                    continue
+                await self._catch_up(db, paper_id, scores)
+                if await self._write_snapshot(db, paper_id, scores):
+                    written += 1
+        self.snapshots_written += written
+        return written
+
+    async def _write_snapshot(self, db, paper_id: int, scores: _PaperScores) -> bool:
+        # Attempts above high_water are left out; a restart counts them again
+        counts = scores.distribution.as_counts()
+        for marks in scores.local.values():
+            counts[marks] -= 1
+        values = {
+            "counts": json.dumps({str(marks): count for marks, count in counts.items() if count}),
+            "last_submission_id": scores.high_water,
+            "taken_at": datetime.utcnow(),
+        }
+        snapshots = models.ScoreSnapshot
+        async with serialized_writes():
+            # Compare-and-set on epoch, so a distribution loaded before a re-grade can't overwrite its reset
+            result = await db.execute(
+                update(snapshots)
+                .where(snapshots.paper_id == paper_id, snapshots.epoch == scores.epoch)
+                .values(**values)
+            )
+            if result.rowcount == 0:
+                if await db.get(snapshots, paper_id) is not None:
+                    await db.rollback()
+                    self._drop(paper_id)
+                    return False
+                db.add(snapshots(paper_id=paper_id, epoch=scores.epoch, **values))
+            try:
+                await db.commit()
+            except IntegrityError:
+                # Another worker wrote the first snapshot meanwhile
+                await db.rollback()
+                return False
+        return True
+
+    def start(self):
+        """Run the snapshot loop on the running event loop."""
+        if self._task is not None:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), SCORE_SNAPSHOT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.snapshot()
+            except Exception:
+                logger.exception("Score snapshot failed, retrying in %ss", SCORE_SNAPSHOT_INTERVAL)
+
+    async def drain(self):
+        """Stop the snapshot loop after a last snapshot."""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            **self._papers.stats(),
+            "loads": self.loads,
+            "snapshot_loads": self.snapshot_loads,
+            "refreshes": self.refreshes,
+            "snapshots_written": self.snapshots_written,
+            "unsaved_papers": len(self._dirty),
+        }
+
+score_index = ScoreIndex()
+
+
+async def reset_scores(db, paper_id: int):
+    """Empty a paper's snapshot and move it to a new epoch after its marks changed.
+
+    Runs in the caller's transaction; call score_index.invalidate() after it commits.
+    """
+    snapshot = await db.get(models.ScoreSnapshot, paper_id)
+    if snapshot is None:
+        snapshot = models.ScoreSnapshot(paper_id=paper_id, epoch=0)
+        db.add(snapshot)
+    snapshot.counts = "{}"
+    snapshot.last_submission_id = 0
+    snapshot.epoch = (snapshot.epoch or 0) + 1
+    snapshot.taken_at = datetime.utcnow()
@@ -0,0 +1,194 @@
+import argparse
+import os
+import re
+from sqlalchemy import func, select, text
+from database import IS_SQLITE
+from storage import resolve_pdf_path
+import models
+
+# Cap on text kept per PDF; past this point extra pages rarely help ranking
+PDF_TEXT_MAX_CHARS = int(os.getenv("PDF_TEXT_MAX_CHARS", "200000"))
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SNIPPET_TOKENS = 12
+
+# FTS5 keeps its own copy of the text (needed for snippets), one row per
+# paper with rowid = papers.id. Column weights for bm25 follow the order:
+# a title hit counts most, a match deep inside the PDF least.
+BM25_WEIGHTS = "10.0, 4.0, 2.0, 1.0"
+CREATE_INDEX = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5("
+    "title, description, questions, pdf_text, tokenize='porter unicode61 remove_diacritics 2', "
+    # Prefix indexes keep search-as-you-type queries like "ox"* from scanning every term
+    "prefix='2 3')"
+)
+
+# Sentinel for index_paper: leave the stored PDF text as it is
+KEEP = object()
+
+
+def reader_text(reader) -> str:
+    """Plain text of an open pypdf reader, capped at PDF_TEXT_MAX_CHARS."""
+    from pypdf.errors import PyPdfError
+
+    parts = []
+    size = 0
+    try:
+        for page in reader.pages:
+            chunk = page.extract_text() or ""
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= PDF_TEXT_MAX_CHARS:
+                break
+    except (PyPdfError, OSError, ValueError):
+        pass
+    return "\n".join(parts)[:PDF_TEXT_MAX_CHARS]
+
+def extract_pdf_text(path) -> str:
+    """Plain text of a PDF, or "" when it can't be parsed (scans, broken files)."""
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+
+    try:
+        return reader_text(PdfReader(path))
+    except (PyPdfError, OSError, ValueError):
+        return ""
+
+async def known_pdf_text(db, pdf_path):
+    """Text already indexed for a stored PDF, or None if it still has to be extracted.
+
+    Blobs are content-addressed, so any paper sharing the path has the same
+    text. Extraction itself runs in the process_pdf job (jobs.py).
+    """
+    if not pdf_path or not IS_SQLITE:
+        return None
+    return await db.scalar(
+        text("SELECT pdf_text FROM papers_fts WHERE pdf_text != '' AND rowid IN "
+             "(SELECT id FROM papers WHERE pdf_path = :path) LIMIT 1"),
+        {"path": pdf_path},
+    )
+
+
+def to_match_query(q: str):
+    """Turn free text into a safe FTS5 query: every word must match.
+
+    Only the last word is matched as a prefix (it may still be being typed);
+    expanding every word would multiply the rows bm25 has to score.
+    """
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return None
+    return " ".join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+
+
+async def index_paper(db, paper_id: int, pdf_text=KEEP):
+    """Rebuild a paper's index row inside the caller's transaction.
+
+    Pass the freshly extracted pdf_text when the PDF changed; by default the
+    text already in the index is kept so metadata edits don't re-parse PDFs.
+    """
+    if not IS_SQLITE:
+        return
+    paper = await db.get(models.Paper, paper_id)
+    if paper is None:
+        await remove_paper(db, paper_id)
+        return
+    if pdf_text is KEEP:
+        pdf_text = await db.scalar(text("SELECT pdf_text FROM papers_fts WHERE rowid = :id"), {"id": paper_id})
+    questions = (await db.scalars(
+        select(models.Question.question_text)
+        .where(models.Question.paper_id == paper_id)
+        .order_by(models.Question.id)
+    )).all()
+    await db.execute(text("DELETE FROM papers_fts WHERE rowid = :id"), {"id": paper_id})
+    await db.execute(
+        text("INSERT INTO papers_fts (rowid, title, description, questions, pdf_text) "
+             "VALUES (:id, :title, :description, :questions, :pdf_text)"),
+        {
+            "id": paper_id,
+            "title": paper.title or "",
+            "description": paper.description or "",
+            "questions": "\n".join(q or "" for q in questions),
+            "pdf_text": pdf_text or "",
+        },
+    )
+
+async def remove_paper(db, paper_id: int):
+    if IS_SQLITE:
+        await db.execute(text("DELETE FROM papers_fts WHERE rowid = :id"), {"id": paper_id})
+
+
+async def search_papers(db, q: str, limit: int = SEARCH_DEFAULT_LIMIT) -> list:
+    """Best matches first, each with a highlighted snippet from its best column."""
+    match = to_match_query(q)
+    if match is None:
+        return []
+    if not IS_SQLITE:
+        # No FTS5 elsewhere: unranked substring match on the paper itself;
+        # autoescape matches % and _ in the query literally
+        papers = (await db.scalars(
+            select(models.Paper)
+            .where(models.Paper.title.icontains(q, autoescape=True)
+                   | models.Paper.description.icontains(q, autoescape=True))
+            .order_by(models.Paper.id)
+            .limit(limit)
+        )).all()
+        return [{"id": p.id, "title": p.title, "snippet": (p.description or "")[:200], "score": 0.0} for p in papers]
+    rows = await db.execute(
+        text(
+            "SELECT rowid, title, "
+            f"snippet(papers_fts, -1, '[', ']', '…', {SNIPPET_TOKENS}), "
+            f"bm25(papers_fts, {BM25_WEIGHTS}) AS score "
+            "FROM papers_fts WHERE papers_fts MATCH :match ORDER BY score LIMIT :limit"
+        ),
+        {"match": match, "limit": limit},
+    )
+    # bm25 is lower-is-better; flip it so clients can sort by score descending
+    return [{"id": row[0], "title": row[1], "snippet": row[2], "score": -row[3]} for row in rows]
+
+
+def build_search_index(engine, with_pdf_text: bool = True, rebuild: bool = False) -> int:
+    """Create the FTS table and fill it from existing papers when it is empty."""
+    if not IS_SQLITE:
+        return 0
+    papers = models.Paper.__table__
+    questions = models.Question.__table__
+    with engine.begin() as conn:
+        conn.exec_driver_sql(CREATE_INDEX)
+        if rebuild:
+            conn.exec_driver_sql("DELETE FROM papers_fts")
+        elif conn.exec_driver_sql("SELECT count(*) FROM papers_fts").scalar():
+            return 0
+        question_text = dict(conn.execute(
+            select(questions.c.paper_id, func.group_concat(questions.c.question_text, "\n"))
+            .group_by(questions.c.paper_id)
+        ).all())
+        rows = [
+            {
+                "id": paper.id,
+                "title": paper.title or "",
+                "description": paper.description or "",
+                "questions": question_text.get(paper.id) or "",
+                "pdf_text": extract_pdf_text(resolve_pdf_path(paper.pdf_path))
+                if with_pdf_text and paper.pdf_path else "",
+            }
+            for paper in conn.execute(select(papers))
+        ]
+        if rows:
+            conn.execute(
+                text("INSERT INTO papers_fts (rowid, title, description, questions, pdf_text) "
+                     "VALUES (:id, :title, :description, :questions, :pdf_text)"),
+                rows,
+            )
+            conn.exec_driver_sql("INSERT INTO papers_fts (papers_fts) VALUES ('optimize')")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Maintain the paper search index")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--skip-pdf-text", action="store_true", help="index metadata and questions only")
+    args = parser.parse_args()
+    print({"indexed": build_search_index(engine, with_pdf_text=not args.skip_pdf_text, rebuild=True)})
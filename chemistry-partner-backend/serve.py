@@ -0,0 +1,30 @@
+"""Run the API with WEB_CONCURRENCY uvicorn worker processes sharing one port.
+
+In eager mode schema setup runs once here, before the workers start. In fast
+mode it is left to the workers, so the port opens first; they take turns
+under startup.STARTUP_LOCK_PATH. Rate-limit counters and cache
+invalidations are shared between the workers through shared_state.py.
+"""
+import os
+import uvicorn
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "10000"))
+
+
+if __name__ == "__main__":
+    from shared_state import SHARED_STATE_ENABLED, WEB_CONCURRENCY, init_shared_state
+    from startup import STARTUP_MODE
+
+    if STARTUP_MODE == "eager":
+        from database import create_tables, engine
+        import models  # noqa: F401
+        from progress import backfill_progress_stats
+
+        create_tables()
+        backfill_progress_stats(engine)
+        engine.dispose()
+    if SHARED_STATE_ENABLED:
+        init_shared_state()
+
+    uvicorn.run("main:app", host=HOST, port=PORT, workers=WEB_CONCURRENCY)
@@ -0,0 +1,172 @@
+import os
+import sqlite3
+import threading
+import time
+from limits.storage import Storage
+
+# Number of worker processes serving the app (also read by uvicorn --workers)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# SQLite file shared by all workers on the host for rate-limit counters and
+# cache invalidations; put it on tmpfs (e.g. /dev/shm) to keep it off disk
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "shared_state.db")
+# With a single worker everything can stay in process memory
+SHARED_STATE_ENABLED = os.getenv("SHARED_STATE", "1" if WEB_CONCURRENCY > 1 else "0") == "1"
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI") or (
+    f"sqlite:///{SHARED_STATE_PATH}" if SHARED_STATE_ENABLED else "memory://"
+)
+# How often a worker picks up invalidations published by the others (seconds)
+SHARED_STATE_POLL_INTERVAL = float(os.getenv("SHARED_STATE_POLL_INTERVAL", "1"))
+# Invalidation log entries older than this are pruned (seconds)
+INVALIDATION_RETENTION = int(os.getenv("INVALIDATION_RETENTION", "3600"))
+# Expired rate-limit rows are swept once every this many increments
+PRUNE_EVERY = 1000
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS rate_limits ("
+    " key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS invalidations ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT, namespace TEXT NOT NULL,"
+    " key TEXT NOT NULL, created_at REAL NOT NULL)",
+)
+
+_local = threading.local()
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    # One autocommit connection per thread and file; every statement below is atomic on its own
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, isolation_level=None, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")  # Counters and invalidations need not survive a crash
+        for statement in SCHEMA:
+            conn.execute(statement)
+        connections[path] = conn
+    return conn
+
+def init_shared_state(path: str = SHARED_STATE_PATH):
+    """Create the shared tables up front, before the workers start."""
+    _connect(path)
+
+
+class SQLiteStorage(Storage):
+    """limits storage keeping fixed-window counters in a SQLite file.
+
+    Every worker on the host opens the same file, so a "5/minute" limit is
+    enforced once across all of them rather than once per process.
+    Select it with a sqlite:///path URI.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.path = uri[len("sqlite:///"):] or SHARED_STATE_PATH
+        self._increments = 0
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _conn(self) -> sqlite3.Connection:
+        return _connect(self.path)
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        now = time.time()
+        # A single upsert, so concurrent workers can't lose increments
+        count = self._conn().execute(
+            "INSERT INTO rate_limits (key, count, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            " count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END,"
+            " expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END "
+            "RETURNING count",
+            (key, amount, now + expiry, now, now),
+        ).fetchone()[0]
+        self._increments += 1
+        if self._increments % PRUNE_EVERY == 0:
+            self._conn().execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+        return count
+
+    def get(self, key: str) -> int:
+        row = self._conn().execute(
+            "SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        row = self._conn().execute("SELECT expires_at FROM rate_limits WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self) -> bool:
+        try:
+            self._conn().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._conn().execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key: str):
+        self._conn().execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+
+class InvalidationBus:
+    """Cross-worker cache invalidation through an append-only log table.
+
+    publish() records that a key changed; every worker replays entries it
+    has not seen yet at most once per poll interval and hands them to the
+    handlers registered for the namespace. Caches stay per-process, so hits
+    never leave memory, and staleness is bounded by the poll interval.
+    """
+
+    def __init__(self, path: str = SHARED_STATE_PATH, enabled: bool = SHARED_STATE_ENABLED,
+                 poll_interval: float = SHARED_STATE_POLL_INTERVAL):
+        self.path = path
+        self.enabled = enabled
+        self.poll_interval = poll_interval
+        self._handlers = {}
+        self._last_id = None
+        self._next_poll = 0.0
+
+    def subscribe(self, namespace: str, handler):
+        self._handlers.setdefault(namespace, []).append(handler)
+
+    def publish(self, namespace: str, key: str):
+        if not self.enabled:
+            return
+        now = time.time()
+        conn = _connect(self.path)
+        conn.execute(
+            "INSERT INTO invalidations (namespace, key, created_at) VALUES (?, ?, ?)",
+            (namespace, key, now),
+        )
+        conn.execute("DELETE FROM invalidations WHERE created_at < ?", (now - INVALIDATION_RETENTION,))
+
+    def poll(self, force: bool = False) -> int:
+        """Apply invalidations published by other workers; returns how many were seen."""
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        if not force and now < self._next_poll:
+            return 0
+        self._next_poll = now + self.poll_interval
+        conn = _connect(self.path)
+        if self._last_id is None:
+            # A fresh worker has empty caches, so only later entries matter
+            self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM invalidations").fetchone()[0]
+            return 0
+        rows = conn.execute(
+            "SELECT id, namespace, key FROM invalidations WHERE id > ? ORDER BY id", (self._last_id,)
+        ).fetchall()
+        for row_id, namespace, key in rows:
+            for handler in self._handlers.get(namespace, ()):
+                handler(key)
+            self._last_id = row_id
+        return len(rows)
+
+
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,119 @@
+import asyncio
+import importlib.util
+import os
+import sys
+import time
+from contextlib import contextmanager
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, and no forked workers to coordinate
+    fcntl = None
+
+# "eager" prepares the database and upload dir while main is imported, as
+# before. "fast" defers that to a background task started by the startup
+# hook (or the first request), so the port opens as soon as the app is built.
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager").lower()
+if STARTUP_MODE not in ("eager", "fast"):
+    raise ValueError(f"STARTUP_MODE must be 'eager' or 'fast', got {STARTUP_MODE!r}")
+
+# Paths that answer before preparation has finished
+READINESS_EXEMPT_PATHS = ("/health/",)
+# Workers on the host take turns preparing under this file lock: the first
+# does the work, the rest find it done instead of racing it
+STARTUP_LOCK_PATH = os.getenv("STARTUP_LOCK_PATH", "startup.lock")
+
+
+def lazy_import(name: str):
+    """Return module `name`, deferring its actual import to first attribute access."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+@contextmanager
+def host_lock(path: str):
+    """Exclusive lock shared by every process on the host that opens `path`."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class StartupGate:
+    """Runs one-off preparation exactly once and lets requests wait for it.
+
+    In fast mode the work runs in a worker thread so the event loop keeps
+    answering health checks meanwhile. A failed run is retried by the next
+    caller instead of leaving the process permanently broken. Runs in other
+    worker processes wait for each other on STARTUP_LOCK_PATH, so `prepare`
+    must notice work that is already done.
+    """
+
+    def __init__(self, prepare, lock_path: str = STARTUP_LOCK_PATH):
+        self._prepare = prepare
+        self._lock_path = lock_path
+        self._task = None
+        self.ready = False
+        self.error = None
+        self.duration = None
+
+    def run_sync(self):
+        started = time.perf_counter()
+        with host_lock(self._lock_path):
+            self._prepare()
+        self.duration = time.perf_counter() - started
+        self.ready = True
+
+    async def _run(self):
+        try:
+            await run_in_threadpool(self.run_sync)
+            self.error = None
+        except Exception as e:
+            self.error = repr(e)
+            raise
+
+    def start(self):
+        if self.ready:
+            return
+        if self._task is None or (self._task.done() and self._task.exception() is not None):
+            self._task = asyncio.ensure_future(self._run())
+
+    async def wait(self):
+        self.start()
+        if not self.ready:
+            await asyncio.shield(self._task)
+
+    def status(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "starting",
+            "mode": STARTUP_MODE,
+            "prepare_seconds": self.duration,
+            "error": self.error,
+        }
+
+
+class ReadinessMiddleware:
+    """Holds requests until the gate is open; a single attribute check once it is."""
+
+    def __init__(self, app, gate: StartupGate, exempt=READINESS_EXEMPT_PATHS):
+        self.app = app
+        self.gate = gate
+        self.exempt = exempt
+
+    async def __call__(self, scope, receive, send):
+        if not self.gate.ready and scope["type"] == "http" and not scope["path"].startswith(self.exempt):
+            await self.gate.wait()
+        await self.app(scope, receive, send)
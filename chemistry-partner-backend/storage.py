@@ -0,0 +1,251 @@
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from fastapi import HTTPException, UploadFile, status
+from sqlalchemy import func, select
+from starlette.concurrency import run_in_threadpool
+import models
+from instrumentation import timed
+
+# Define upload directory
+UPLOAD_DIR = Path("uploads/pdfs")
+
+MAX_PDF_SIZE = 10 * 1024 * 1024  # 10MB
+UPLOAD_CHUNK_SIZE = 256 * 1024
+PDF_MAGIC = b"%PDF-"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Unreferenced blobs touched more recently than this are left for the next
+# GC run, so a concurrent identical upload can't lose its file
+BLOB_GRACE_SECONDS = int(os.getenv("BLOB_GRACE_SECONDS", "60"))
+
+
+class PendingUpload:
+    """A fully received and validated PDF sitting in a temp file next to its destination."""
+
+    def __init__(self, temp_path: Path, handle, size: int, sha256: str):
+        self.temp_path = temp_path
+        self._handle = handle
+        self.size = size
+        self.sha256 = sha256
+        self.deduplicated = False
+
+    async def commit(self, final_path: Path) -> Path:
+        # os.replace is atomic on the same filesystem, so readers never see a partial file
+        with timed("file"):
+            await run_in_threadpool(_sync_and_replace, self._handle, self.temp_path, final_path)
+        return final_path
+
+    async def discard(self):
+        await run_in_threadpool(_close_and_unlink, self._handle, self.temp_path)
+
+
+def _unlink_quietly(path: Path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def _close_and_unlink(handle, path: Path):
+    handle.close()
+    _unlink_quietly(path)
+
+def _sync_and_replace(handle, temp_path: Path, final_path: Path):
+    handle.flush()
+    os.fsync(handle.fileno())
+    handle.close()
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(temp_path, final_path)
+
+
+async def receive_pdf(upload: UploadFile, upload_dir: Path = UPLOAD_DIR) -> PendingUpload:
+    """Stream an uploaded PDF to a temp file chunk by chunk.
+
+    The %PDF- signature is checked on the first chunk, the size cap is enforced
+    while streaming and the SHA-256 is computed incrementally, so memory use is
+    bounded by UPLOAD_CHUNK_SIZE regardless of the file size.
+    """
+    if not upload.filename or not upload.filename.lower().endswith(".pdf"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File must be a PDF document"
+        )
+
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=upload_dir, suffix=".part")
+    temp_path = Path(temp_name)
+    handle = os.fdopen(fd, "wb")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        await upload.seek(0)
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if size == 0 and not chunk.startswith(PDF_MAGIC):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid PDF file format"
+                )
+            size += len(chunk)
+            if size > MAX_PDF_SIZE:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail="File size exceeds 10MB limit"
+                )
+            digest.update(chunk)
+            with timed("file"):
+                await run_in_threadpool(handle.write, chunk)
+        if size == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid PDF file format"
+            )
+    except BaseException:
+        await run_in_threadpool(_close_and_unlink, handle, temp_path)
+        raise
+
+    return PendingUpload(temp_path, handle, size, digest.hexdigest())
+
+
+# Content-addressed blob store: every distinct PDF is kept once under
+# uploads/pdfs/<first two hex digits>/<sha256>.pdf and Paper.pdf_path points
+# at it. A blob's reference count is the number of papers with that pdf_path.
+
+def blob_path(sha256: str, upload_dir: Path = UPLOAD_DIR) -> Path:
+    return upload_dir / sha256[:2] / f"{sha256}.pdf"
+
+def blob_digest(path: Path):
+    """SHA-256 a blob is stored under, or None for legacy file names."""
+    stem = path.stem
+    if len(stem) == 64 and all(c in "0123456789abcdef" for c in stem):
+        return stem
+    return None
+
+def content_etag(path: Path):
+    """Strong ETag for a blob, which is simply its SHA-256 file name."""
+    digest = blob_digest(path)
+    return f'"{digest}"' if digest else None
+
+def resolve_pdf_path(pdf_path: str) -> Path:
+    # Rows written on Windows hold backslash-separated paths
+    return Path(pdf_path.replace("\\", "/"))
+
+def _touch_if_exists(path: Path) -> bool:
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def _remove_if_idle(path: Path) -> bool:
+    try:
+        if time.time() - path.stat().st_mtime < BLOB_GRACE_SECONDS:
+            return False
+        path.unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+async def store_blob(pending: PendingUpload) -> Path:
+    """Move a received upload into the blob store, or drop it if the content is already there."""
+    final_path = blob_path(pending.sha256)
+    with timed("file"):
+        exists = await run_in_threadpool(_touch_if_exists, final_path)
+    if exists:
+        # Identical content already stored: only the paper's pdf_path changes
+        await pending.discard()
+        pending.deduplicated = True
+        return final_path
+    return await pending.commit(final_path)
+
+async def count_references(db, pdf_path: str) -> int:
+    return await db.scalar(
+        select(func.count()).select_from(models.Paper).where(models.Paper.pdf_path == pdf_path)
+    )
+
+async def release_blob(db, pdf_path: str) -> bool:
+    """Delete a stored PDF once no paper references it any more. Call after committing."""
+    if not pdf_path or await count_references(db, pdf_path) > 0:
+        return False
+    return await run_in_threadpool(_remove_if_idle, resolve_pdf_path(pdf_path))
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def migrate_legacy_files(db, upload_dir: Path = UPLOAD_DIR, dry_run: bool = False) -> dict:
+    """Move papers still pointing at paper_{id}_{timestamp}.pdf files into the blob store."""
+    moved = {}
+    missing = 0
+    for paper in db.query(models.Paper).filter(models.Paper.pdf_path.isnot(None)).all():
+        path = resolve_pdf_path(paper.pdf_path)
+        if path.parent != upload_dir:
+            continue  # already a blob
+        if paper.pdf_path not in moved:
+            if not path.exists():
+                missing += 1
+                continue
+            target = blob_path(hash_file(path), upload_dir)
+            if not dry_run:
+                if target.exists():
+                    path.unlink()
+                else:
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(path, target)
+            moved[paper.pdf_path] = target.as_posix()
+        if not dry_run:
+            paper.pdf_path = moved[paper.pdf_path]
+            db.commit()
+    return {"migrated_files": len(moved), "missing": missing, "dry_run": dry_run}
+
+def collect_garbage(db, upload_dir: Path = UPLOAD_DIR, dry_run: bool = False,
+                    grace_seconds: int = BLOB_GRACE_SECONDS) -> dict:
+    """Remove files under upload_dir that no paper references (blobs, legacy files, stale temp files)."""
+    referenced = {
+        resolve_pdf_path(pdf_path).resolve()
+        for (pdf_path,) in db.query(models.Paper.pdf_path).filter(models.Paper.pdf_path.isnot(None))
+    }
+    removed = 0
+    kept = 0
+    reclaimed_bytes = 0
+    now = time.time()
+    for path in upload_dir.rglob("*"):
+        if not path.is_file():
+            continue
+        if path.resolve() in referenced:
+            kept += 1
+            continue
+        stat = path.stat()
+        if now - stat.st_mtime < grace_seconds:
+            kept += 1
+            continue
+        if not dry_run:
+            path.unlink()
+        removed += 1
+        reclaimed_bytes += stat.st_size
+    return {"removed": removed, "kept": kept, "reclaimed_bytes": reclaimed_bytes, "dry_run": dry_run}
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Maintain the content-addressed PDF store")
+    parser.add_argument("command", choices=["gc", "migrate"])
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--grace-seconds", type=int, default=BLOB_GRACE_SECONDS)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        if args.command == "migrate":
+            print(migrate_legacy_files(db, dry_run=args.dry_run))
+        else:
+            print(collect_garbage(db, dry_run=args.dry_run, grace_seconds=args.grace_seconds))
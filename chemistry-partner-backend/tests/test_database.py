@@ -0,0 +1,26 @@
+import asyncio
+from sqlalchemy import text
+import database
+from database import AsyncSessionLocal, async_engine, hold_writes
+
+
+async def _lock_states():
+    states = []
+    async with AsyncSessionLocal() as db:
+        await db.execute(text("SELECT 1"))
+        await hold_writes(db)
+        await hold_writes(db)
+        states.append(database._sqlite_writes.locked())
+        await db.commit()
+        states.append(database._sqlite_writes.locked())
+        await hold_writes(db)
+        await db.rollback()
+        states.append(database._sqlite_writes.locked())
+        await hold_writes(db)
+    states.append(database._sqlite_writes.locked())
+    await async_engine.dispose()
+    return states
+
+
+def test_hold_writes_lasts_until_the_transaction_ends():
+    assert asyncio.run(_lock_states()) == [True, False, False, False]
@@ -0,0 +1,68 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import List
+from pydantic import TypeAdapter
+from sqlalchemy import delete, select
+from sqlalchemy.orm import selectinload
+from database import AsyncSessionLocal, async_engine, create_tables
+from fast_json import dumps, fetch_paper_rows, fetch_submission_rows
+from history import submission_page
+import models
+import schemas
+
+USER_ID = 424242
+
+
+async def _both_paths():
+    create_tables()
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(models.Question))
+        await db.execute(delete(models.PaperSubmission))
+        await db.execute(delete(models.Paper))
+        first = models.Paper(title="Équilibria", description="Kc & Kp \"quoted\"", duration_minutes=45,
+                             total_marks=20, pdf_path="uploads/pdfs/ab/abc.pdf")
+        second = models.Paper(title="Acids", description="", duration_minutes=30, total_marks=10)
+        db.add_all([first, second])
+        await db.flush()
+        db.add_all([
+            models.Question(paper_id=first.id, question_text="ΔG° at 298 K?", answer="-12 kJ/mol", marks=3),
+            models.Question(paper_id=first.id, question_text="Kc?", answer="4.2", marks=2),
+            models.Question(paper_id=second.id, question_text="pH of water", answer="7", marks=1),
+        ])
+        db.add_all([
+            models.PaperSubmission(paper_id=first.id, user_id=USER_ID, time_spent=600, marks=4,
+                                   submitted_at=datetime(2026, 1, 2, 3, 4, 5, 678901)),
+            models.PaperSubmission(paper_id=second.id, user_id=USER_ID, time_spent=60, marks=1,
+                                   submitted_at=datetime(2026, 1, 3)),
+        ])
+        await db.commit()
+
+    pairs = []
+    async with AsyncSessionLocal() as db:
+        papers = (await db.scalars(
+            select(models.Paper).order_by(models.Paper.id).options(selectinload(models.Paper.questions))
+        )).all()
+        for schema, include_questions, include_answers in (
+            (schemas.Paper, True, True),
+            (schemas.StudentPaper, True, False),
+            (schemas.PaperSummary, False, False),
+        ):
+            adapter = TypeAdapter(List[schema])
+            rows = await fetch_paper_rows(db, 10, None, include_questions, include_answers)
+            pairs.append((dumps(rows), adapter.dump_json(adapter.validate_python(papers, from_attributes=True)),
+                          adapter.dump_json(papers)))
+        adapter = TypeAdapter(List[schemas.PaperSubmission])
+        submissions = (await db.scalars(submission_page(select(models.PaperSubmission), USER_ID, 10))).all()
+        rows = await fetch_submission_rows(db, USER_ID, 10)
+        pairs.append((dumps(rows), adapter.dump_json(adapter.validate_python(submissions, from_attributes=True)),
+                      adapter.dump_json(submissions)))
+    await async_engine.dispose()
+    return pairs
+
+
+def test_fast_path_matches_response_model_bytes():
+    for fast, validated, orm in asyncio.run(_both_paths()):
+        assert fast == validated
+        # Dumping ORM objects directly keeps their attribute order, not the schema's
+        assert json.loads(fast) == json.loads(orm)
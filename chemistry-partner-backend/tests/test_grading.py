@@ -0,0 +1,45 @@
+import pytest
+from grading import AnswerKey, parse_number
+
+
+def grade(key: str, answer: str) -> int:
+    return AnswerKey(1, [(1, key, 1)]).grade({1: answer})
+
+
+@pytest.mark.parametrize("key, answer, marks", [
+    # Digit-led names and configurations are text, not a number plus a "unit"
+    ("2-methylpropane", "2", 0),
+    ("2-methylpropane", "2-Methylpropane", 1),
+    ("1s2 2s2 2p6", "1", 0),
+    ("1s2 2s2 2p6", "1s2 2s2 2p6", 1),
+    ("1s1", "1", 0),
+    # A unit on the answer must be the key's
+    ("7", "7 kg", 0),
+    ("7", "7", 1),
+    ("7 g", "7 kg", 0),
+    ("7 g", "7 g", 1),
+    ("7 g", "7", 1),
+    ("8.314 J/(mol K)", "8.31 J/(mol K)", 1),
+    ("0.1 mol dm-3", "0.100 mol dm⁻³", 1),
+    ("25 cm3", "25 cm³", 1),
+    ("6.02e23", "6.02 x 10^23", 1),
+    # Words stay case-insensitive; formulas need a digit or two element symbols
+    ("No", "no", 1),
+    ("Yes", "yes", 1),
+    ("NaCl", "nacl", 0),
+    ("NaCl", "NaCl", 1),
+    ("CO2", "co2", 0),
+    ("Mg2+", "Mg²⁺", 1),
+])
+def test_grade(key, answer, marks):
+    assert grade(key, answer) == marks
+
+
+@pytest.mark.parametrize("value", ["1e999", "1 x 10^400", "2-methylpropane", "1s2 2s2 2p6", "3 apples"])
+def test_parse_number_rejects(value):
+    assert parse_number(value) is None
+
+
+def test_parse_number_units():
+    assert parse_number("6.02 x 10^23 mol") == (6.02e23, "mol")
+    assert parse_number("8.314 J/(mol K)") == (8.314, "j/(molk)")
@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from database import AsyncSessionLocal, async_engine, create_tables
+from jobs import JobQueue
+import models
+
+
+class _RequeuedAfterSelect:
+    """Session whose candidate SELECT is followed by another worker running and requeueing the job."""
+
+    def __init__(self, session, job_id):
+        self._session = session
+        self._job_id = job_id
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    async def __aenter__(self):
+        await self._session.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        return await self._session.__aexit__(*exc)
+
+    async def scalars(self, statement, *args, **kwargs):
+        candidates = await self._session.scalars(statement, *args, **kwargs)
+        async with AsyncSessionLocal() as other:
+            await other.execute(
+                update(models.PaperJob).where(models.PaperJob.id == self._job_id)
+                .values(status="queued", attempts=1, run_after=datetime.utcnow() + timedelta(seconds=60))
+            )
+            await other.commit()
+        return candidates
+
+
+async def _claim_requeued_job():
+    create_tables()
+    async with AsyncSessionLocal() as db:
+        now = datetime.utcnow()
+        job = models.PaperJob(kind="process_pdf", paper_id=1, pdf_path="x.pdf", status="queued",
+                              attempts=0, run_after=now - timedelta(seconds=1), created_at=now)
+        db.add(job)
+        await db.commit()
+        job_id = job.id
+    queue = JobQueue(workers=1, session_factory=lambda: _RequeuedAfterSelect(AsyncSessionLocal(), job_id))
+    queue.worker_id = "test"
+    claimed = await queue._claim()
+    async with AsyncSessionLocal() as db:
+        stored = await db.get(models.PaperJob, job_id)
+    await async_engine.dispose()
+    return claimed, stored
+
+
+def test_requeued_job_is_not_claimed_before_run_after():
+    claimed, stored = asyncio.run(_claim_requeued_job())
+    assert claimed is None
+    assert stored.status == "queued"
+    assert stored.attempts == 1